@@ -1,4 +1,11 @@
 # pylint: disable=import-error
+from contextlib import contextmanager
+
+from System.Collections.Specialized import (
+    INotifyCollectionChanged,
+    NotifyCollectionChangedAction,
+    NotifyCollectionChangedEventArgs
+)
 from System.ComponentModel import (
     INotifyPropertyChanged,
     PropertyChangedEventArgs
@@ -8,10 +15,12 @@ import pyevent
 
 class NotifyPropertyChangedBase(INotifyPropertyChanged):
     PropertyChanged = None
+    _suspended = 0
 
     def __init__(self):
         self.PropertyChanged, self._propertyChangedCaller = \
             pyevent.make_event()
+        self._pending = []
 
     def add_PropertyChanged(self, value):
         self.PropertyChanged += value
@@ -20,10 +29,80 @@ class NotifyPropertyChangedBase(INotifyPropertyChanged):
         self.PropertyChanged -= value
 
     def OnPropertyChanged(self, property_name):
+        # Merged until notifications are resumed
+        if self._suspended:
+            if property_name not in self._pending:
+                self._pending.append(property_name)
+            return
+
         if self.PropertyChanged is not None:
             self._propertyChangedCaller(
                 self, PropertyChangedEventArgs(property_name))
 
+    def suspend_notifications(self):
+        if not self._suspended:
+            self._pending = []
+        self._suspended += 1
+
+    # Returns the names of the properties that changed while suspended
+    def resume_notifications(self, raise_pending=True):
+        self._suspended -= 1
+        if self._suspended:
+            return []
+
+        pending, self._pending = self._pending, []
+        if raise_pending:
+            for property_name in pending:
+                self.OnPropertyChanged(property_name)
+
+        return pending
+
+
+# Suspends notifications of every item. On exit each item raises its merged
+# changes, or on_resume is called once instead, e.g. to reset the
+# collection holding the items.
+@contextmanager
+def suspended_notifications(items, on_resume=None):
+    items = list(items)
+    for item in items:
+        item.suspend_notifications()
+
+    try:
+        yield
+    finally:
+        changed = False
+        for item in items:
+            if item.resume_notifications(raise_pending=on_resume is None):
+                changed = True
+
+        if changed and on_resume is not None:
+            on_resume()
+
+
+class ObservableList(list, INotifyCollectionChanged):
+    CollectionChanged = None
+
+    def __init__(self, items=()):
+        list.__init__(self, items)
+        self.CollectionChanged, self._collectionChangedCaller = \
+            pyevent.make_event()
+
+    def add_CollectionChanged(self, value):
+        self.CollectionChanged += value
+
+    def remove_CollectionChanged(self, value):
+        self.CollectionChanged -= value
+
+    # Bound views re-read every item
+    def reset(self):
+        if self.CollectionChanged is not None:
+            self._collectionChangedCaller(
+                self,
+                NotifyCollectionChangedEventArgs(
+                    NotifyCollectionChangedAction.Reset
+                )
+            )
+
 
 class notify_property(property):
     def __init__(self, getter):
@@ -48,25 +127,159 @@ class notify_property(property):
             doc=self.__doc__)
 
 
+_missing = object()
+
+
+# LRU cache decorator. Use bare as @memoize or with options as
+# @memoize(maxsize=..., invalidate=...). invalidate returns a token, e.g.
+# get_document_token, and invalidate_caches clears the cache whenever the
+# token changed.
 class memoize(object):
-    def __init__(self, func):
+    instances = []
+
+    def __init__(self, func=None, maxsize=128, invalidate=None):
+        from collections import OrderedDict
+
+        self.maxsize = maxsize
+        self.invalidate = invalidate
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._token = _missing
+        self.func = None
+        if invalidate is not None:
+            memoize.instances.append(self)
+        if func is not None:
+            self.wrap(func)
+
+    def wrap(self, func):
+        import inspect
+
         self.func = func
-        self.cache = {}
+        self.argnames = inspect.getargs(func.__code__).args
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+        return self
 
     def __call__(self, *args, **kwargs):
+        # @memoize(...) is called with the function to decorate
+        if self.func is None:
+            return self.wrap(*args)
+
         key = self.key(args, kwargs)
-        if key not in self.cache:
-            self.cache[key] = self.func(*args, **kwargs)
-        return self.cache[key]
+        if key in self.cache:
+            self.hits += 1
+            value = self.cache.pop(key)
+        else:
+            self.misses += 1
+            value = self.func(*args, **kwargs)
+            if self.maxsize and len(self.cache) >= self.maxsize:
+                self.cache.popitem(last=False)
 
-    def normalize_args(self, args, kwargs):
-        import inspect
-        spec = inspect.getargs(self.func.__code__).args
-        return dict(kwargs.items() + zip(spec, args))
+        self.cache[key] = value
+        return value
 
+    # Keyword arguments are moved to their position in the argument spec, so
+    # f(1) and f(x=1) share an entry
     def key(self, args, kwargs):
-        normalized_args = self.normalize_args(args, kwargs)
-        return tuple(sorted(normalized_args.items()))
+        if not kwargs:
+            return args
+
+        kwargs = dict(kwargs)
+        values = list(args) + [
+            kwargs.pop(name, _missing)
+            for name in self.argnames[len(args):]
+        ]
+        while values and values[-1] is _missing:
+            values.pop()
+
+        return tuple(values) + tuple(sorted(kwargs.items()))
+
+    def cache_info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'maxsize': self.maxsize,
+            'size': len(self.cache)
+        }
+
+    def cache_clear(self):
+        self.cache.clear()
+        self.hits = self.misses = 0
+
+
+# Clears every memoize whose invalidate token changed. Tokens cost a trip
+# through the Revit API, so scripts call this once per run rather than
+# memoize checking on every call.
+def invalidate_caches():
+    tokens = {}
+    for cache in memoize.instances:
+        if cache.invalidate not in tokens:
+            tokens[cache.invalidate] = cache.invalidate()
+
+        token = tokens[cache.invalidate]
+        if token != cache._token:
+            cache.cache.clear()
+            cache._token = token
+
+
+# Changes when another document is active or the active one is saved or
+# synchronized
+def get_document_token():
+    import rpw
+    from Autodesk.Revit.DB import Document
+
+    doc = rpw.revit.doc
+    try:
+        version = Document.GetDocumentVersion(doc)
+    except AttributeError:
+        # DocumentVersion is available from Revit 2021
+        return (doc.GetHashCode(), doc.PathName)
+
+    return (
+        doc.GetHashCode(),
+        doc.PathName,
+        str(version.VersionGUID),
+        version.NumberOfSaves
+    )
+
+
+class FamilyTypeIndex(object):
+    def __init__(self, family_types):
+        from Autodesk.Revit.DB import Element
+
+        self._family_types = {}
+        for t in family_types:
+            if t.Category is None:
+                continue
+
+            key = (t.Category.Name, t.FamilyName, Element.Name.GetValue(t))
+            if key not in self._family_types:
+                self._family_types[key] = [t]
+            else:
+                self._family_types[key].append(t)
+
+    def __len__(self):
+        return len(self._family_types)
+
+    def __contains__(self, key):
+        return len(self._family_types.get(key, [])) == 1
+
+    def find(self, category, family, family_type):
+        key = (category, family, family_type)
+        matches = self._family_types.get(key)
+        if not matches:
+            raise ValueError(
+                'No family type named {} : {} : {}'.format(*key)
+            )
+        elif len(matches) > 1:
+            raise ValueError(
+                '{} family types named {} : {} : {}'.format(
+                    len(matches), *key
+                )
+            )
+
+        return matches[0]
 
 
 def is_inside_bounding_box(point, box, include_z=True):
@@ -91,6 +304,11 @@ def is_inside_viewplan(point, view):
 
 
 def draw_BoundingBoxXYZ_2D(doc, view, bounding_box):
+    for curve in create_BoundingBoxXYZ_2D(bounding_box):
+        doc.Create.NewDetailCurve(view, curve)
+
+
+def create_BoundingBoxXYZ_2D(bounding_box):
     from Autodesk.Revit.DB import Line, XYZ
 
     x0y0 = XYZ(bounding_box.Min.X, bounding_box.Min.Y, 0)
@@ -98,23 +316,28 @@ def draw_BoundingBoxXYZ_2D(doc, view, bounding_box):
     x0y1 = XYZ(x0y0.X, x1y1.Y, 0)
     x1y0 = XYZ(x1y1.X, x0y0.Y, 0)
 
-    curves = [
+    return [
         Line.CreateBound(x0y0, x0y1),
         Line.CreateBound(x0y1, x1y1),
         Line.CreateBound(x1y1, x1y0),
         Line.CreateBound(x1y0, x0y0)
     ]
-    for curve in curves:
-        doc.Create.NewDetailCurve(view, curve)
 
 
 def draw_circle(center, radius, view, doc):
+    doc.Create.NewDetailCurve(
+        view,
+        create_circle(center, radius)
+    )
+
+
+def create_circle(center, radius):
     import math
     from Autodesk.Revit.DB import Ellipse, XYZ
 
     xaxis, yaxis = XYZ.BasisX, XYZ.BasisY
     start, end = 0, 2*math.pi
-    circle = Ellipse.CreateCurve(
+    return Ellipse.CreateCurve(
         center,
         radius,
         radius,
@@ -123,10 +346,67 @@ def draw_circle(center, radius, view, doc):
         start,
         end
     )
-    doc.Create.NewDetailCurve(
-        view,
-        circle
-    )
+
+
+# Collects debug shapes and draws them with one NewDetailCurveArray per
+# view. When there are more than max_shapes in a view, an evenly spaced
+# subset is drawn.
+class DebugOverlay(object):
+    def __init__(self, doc, max_shapes=None):
+        self.doc = doc
+        self.max_shapes = max_shapes
+        self._views = {}
+        self._shapes = {}
+
+    def __len__(self):
+        return sum(len(shapes) for shapes in self._shapes.values())
+
+    def add_circle(self, center, radius, view):
+        self.add_curves([create_circle(center, radius)], view)
+
+    def add_bounding_box(self, bounding_box, view):
+        self.add_curves(create_BoundingBoxXYZ_2D(bounding_box), view)
+
+    def add_line(self, start, end, view):
+        from Autodesk.Revit.DB import Line
+        self.add_curves([Line.CreateBound(start, end)], view)
+
+    def add_curves(self, curves, view):
+        key = view.Id.IntegerValue
+        if key not in self._shapes:
+            self._views[key] = view
+            self._shapes[key] = [curves]
+        else:
+            self._shapes[key].append(curves)
+
+    def decimate(self, shapes):
+        if not self.max_shapes or len(shapes) <= self.max_shapes:
+            return shapes
+
+        step = len(shapes) / float(self.max_shapes)
+        return [shapes[int(i*step)] for i in range(self.max_shapes)]
+
+    # Must be called inside a transaction. Returns the number of shapes
+    # drawn.
+    def draw(self):
+        from Autodesk.Revit.DB import CurveArray
+
+        cnt = 0
+        for key, shapes in self._shapes.items():
+            curve_array = CurveArray()
+            for curves in self.decimate(shapes):
+                for curve in curves:
+                    curve_array.Append(curve)
+                cnt += 1
+
+            if not curve_array.IsEmpty:
+                self.doc.Create.NewDetailCurveArray(
+                    self._views[key],
+                    curve_array
+                )
+
+        self._views, self._shapes = {}, {}
+        return cnt
 
 
 def get_name(el):
@@ -134,18 +414,24 @@ def get_name(el):
     return rpw.db.Element(el).name
 
 
-def get_parameter(el, name=None, builtin=None):
+def get_parameter(el, name=None, builtin=None, cache=None):
     from Autodesk.Revit.DB import BuiltInParameter
 
     if builtin:
         param = getattr(BuiltInParameter, builtin)
         instanceParam = el.get_Parameter(param)
         if not instanceParam:
-            typeParam = el.Symbol.get_Parameter(param)
+            if cache:
+                typeParam = cache.get_type_parameter(el, builtin=builtin)
+            else:
+                typeParam = el.Symbol.get_Parameter(param)
     elif name:
         instanceParam = el.LookupParameter(name)
         if not instanceParam:
-            typeParam = el.Symbol.LookupParameter(name)
+            if cache:
+                typeParam = cache.get_type_parameter(el, name=name)
+            else:
+                typeParam = el.Symbol.LookupParameter(name)
     else:
         return None
 
@@ -157,6 +443,75 @@ def get_parameter(el, name=None, builtin=None):
         return None
 
 
+# Parameters and formatted values that are the same for every instance of a
+# type, keyed by the type's ElementId and a parameter name or
+# BuiltInParameter name. Thousands of instances share a few dozen types, so
+# each is read once per type.
+class TypeParameterCache(object):
+    def __init__(self, doc):
+        self.doc = doc
+        self._parameters = {}
+        self._value_strings = {}
+        self._element_id_value_strings = {}
+        self._workset_names = {}
+
+    def get_type_parameter(self, el, name=None, builtin=None):
+        from Autodesk.Revit.DB import BuiltInParameter
+
+        type_id = el.GetTypeId()
+        key = (type_id.IntegerValue, name, builtin)
+        if key not in self._parameters:
+            el_type = self.doc.GetElement(type_id)
+            if el_type is None:
+                param = None
+            elif builtin:
+                param = el_type.get_Parameter(
+                    getattr(BuiltInParameter, builtin)
+                )
+            else:
+                param = el_type.LookupParameter(name)
+            self._parameters[key] = param
+
+        return self._parameters[key]
+
+    # Only for parameters whose value is determined by the type, such as
+    # ELEM_FAMILY_PARAM and ELEM_TYPE_PARAM
+    def get_type_value_string(self, el, name=None, builtin=None):
+        from Autodesk.Revit.DB import ElementId
+
+        type_id = el.GetTypeId()
+        key = (type_id.IntegerValue, name, builtin)
+        if key not in self._value_strings:
+            param = get_parameter(el, name=name, builtin=builtin, cache=self)
+            value_string = (
+                param.AsValueString() if param is not None else None
+            )
+
+            # Elements without a type have nothing to share
+            if type_id == ElementId.InvalidElementId:
+                return value_string
+            self._value_strings[key] = value_string
+
+        return self._value_strings[key]
+
+    # Values of ElementId parameters such as phases are the name of the
+    # element they refer to
+    def get_element_id_value_string(self, param):
+        key = (param.Id.IntegerValue, param.AsElementId().IntegerValue)
+        if key not in self._element_id_value_strings:
+            self._element_id_value_strings[key] = param.AsValueString()
+
+        return self._element_id_value_strings[key]
+
+    def get_workset_name(self, workset_id):
+        key = workset_id.IntegerValue
+        if key not in self._workset_names:
+            self._workset_names[key] = \
+                self.doc.GetWorksetTable().GetWorkset(workset_id).Name
+
+        return self._workset_names[key]
+
+
 def load_as_python(yaml_file):
     from pyrevit.coreutils import yaml
 
@@ -196,21 +551,105 @@ def load_as_python(yaml_file):
         return None
 
 
-def load_tsv(tsv):
+TSV_ERROR_CODES = frozenset([
+    '#VALUE!', '#NAME?', '#DIV/0!', '#REF!',
+    '#NULL!', '#N/A', '#NUM!'
+])
+
+
+def iter_tsv(tsv):
     import codecs
 
-    out = []
-    error_codes = [
-        '#VALUE!', '#NAME?', '#DIV/0!', '#REF!',
-        '#NULL!', '#N/A', '#NUM!'
-    ]
     with codecs.open(tsv, 'r', encoding='utf8') as f:
-        for line in f.readlines():
-            values = line.rstrip('\t\r\n').split('\t')
-            if not any(v in error_codes for v in values):
-                out.append(values)
+        for line_number, line in enumerate(f, 1):
+            yield (line_number, line.rstrip('\t\r\n').split('\t'))
+
+
+# Rows after the header line as dicts keyed by lowercase header. Columns
+# from the first pair header on are read as name/value pairs into
+# row['parameters']. Yields (line_number, row, error) with row None when
+# the line is rejected.
+def iter_tsv_records(
+    tsv,
+    required_headers=(),
+    pair_headers=('Parameter', 'Value')
+):
+    lines = iter_tsv(tsv)
+    try:
+        (_, headers) = next(lines)
+    except StopIteration:
+        raise ValueError('{} is empty'.format(tsv))
+
+    fields = []
+    for header in headers:
+        if header in pair_headers:
+            break
+        fields.append(header.lower())
+
+    missing = [
+        header for header in required_headers
+        if header.lower() not in fields
+    ]
+    if missing:
+        raise ValueError('Missing columns: {}'.format(', '.join(missing)))
+
+    for line_number, values in lines:
+        errors = [v for v in values if v in TSV_ERROR_CODES]
+        if errors:
+            yield (line_number, None, 'Cell contains {}'.format(errors[0]))
+            continue
+
+        row = dict(zip(fields, values[:len(fields)]))
+        pairs = values[len(fields):]
+        row['parameters'] = dict(
+            (name, value)
+            for (name, value) in zip(pairs[0::2], pairs[1::2])
+            if name
+        )
+        yield (line_number, row, None)
+
+
+# Parsed rows are kept in a JSON sidecar and reused until the TSV is
+# modified. Returns (rows, [(line_number, error)]).
+def load_tsv_records(tsv, cache_file=None, **kwargs):
+    import json
+    import os
+
+    key = {
+        'path': os.path.abspath(tsv),
+        'mtime': os.path.getmtime(tsv),
+        'size': os.path.getsize(tsv),
+        'schema': sorted(kwargs.items())
+    }
+    if cache_file and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+        except ValueError:
+            cache = {}
+
+        # Schema is compared as JSON would load it
+        if cache.get('key') == json.loads(json.dumps(key)):
+            return (
+                cache['rows'],
+                [tuple(error) for error in cache['errors']]
+            )
+
+    rows, errors = [], []
+    for line_number, row, error in iter_tsv_records(tsv, **kwargs):
+        if error:
+            errors.append((line_number, error))
+        else:
+            rows.append(row)
+
+    if cache_file:
+        try:
+            with open(cache_file, 'w') as f:
+                json.dump({'key': key, 'rows': rows, 'errors': errors}, f)
+        except (IOError, OSError):
+            pass
 
-    return out
+    return (rows, errors)
 
 
 def to_XY(xyz):
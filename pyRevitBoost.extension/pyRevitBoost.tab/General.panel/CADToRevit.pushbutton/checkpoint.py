@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+
+
+# Records which blocks of each block group have been committed, so an
+# interrupted run can pick up after its last committed chunk. Without a
+# path nothing is persisted.
+class Checkpoint(object):
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self._done = {}
+
+    @classmethod
+    def load(cls, path, key):
+        checkpoint = cls(path, key)
+        if not path or not os.path.isfile(path):
+            return checkpoint
+
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except ValueError:
+            return checkpoint
+
+        # Checkpoint belongs to another document, import or configuration
+        if data.get('key') != key:
+            return checkpoint
+
+        for block_name, indices in data.get('done', {}).items():
+            checkpoint._done[block_name] = set(indices)
+
+        return checkpoint
+
+    def __len__(self):
+        return sum(len(indices) for indices in self._done.values())
+
+    def is_done(self, block_name, index):
+        return index in self._done.get(block_name, ())
+
+    def mark_done(self, block_name, indices):
+        if block_name not in self._done:
+            self._done[block_name] = set(indices)
+        else:
+            self._done[block_name].update(indices)
+
+    def save(self):
+        if not self.path:
+            return
+
+        data = {
+            'key': self.key,
+            'done': dict(
+                (block_name, sorted(indices))
+                for block_name, indices in self._done.items()
+            )
+        }
+        with open(self.path, 'w') as f:
+            json.dump(data, f)
+
+    def clear(self):
+        self._done = {}
+        if self.path and os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+def get_checkpoint_path(config_file):
+    return os.path.splitext(config_file)[0] + '.checkpoint.json'
+
+
+def get_checkpoint_key(doc, cad_imports, config_file, block_groups=None):
+    return '|'.join([
+        doc.PathName or doc.Title,
+        ','.join(sorted(i.UniqueId for i in cad_imports or [])),
+        os.path.abspath(config_file),
+        get_block_digest(block_groups) if block_groups else ''
+    ])
+
+
+# Saved indices are positions within each block group, so they only hold
+# while the drawing has the same blocks in the same order, e.g. not after
+# the import is reloaded from a changed DWG
+def get_block_digest(block_groups):
+    digest = hashlib.md5()
+    for block_name in sorted(block_groups):
+        blocks = block_groups[block_name]
+        digest.update(u'{}:{}'.format(block_name, len(blocks)).encode('utf8'))
+        for block in blocks:
+            origin = block.Transform.Origin
+            digest.update('{:.6f},{:.6f},{:.6f};'.format(
+                origin.X,
+                origin.Y,
+                origin.Z
+            ).encode('utf8'))
+
+    return digest.hexdigest()
+
+
+def chunk(items, size):
+    if not size or size < 1:
+        return [items] if items else []
+
+    return [items[i:i+size] for i in range(0, len(items), size)]
@@ -1,16 +1,53 @@
 import sys
 from pyrevit import forms, script
 
+# Drawing more circles than this is slow and unreadable
+MAX_BLOCK_ORIGINS = 5000
+
+
 def edit_config(filepath):
     import os
     os.startfile(filepath)
 
 
+def set_chunk_size(script_config):
+    chunk_size = forms.ask_for_string(
+        default=str(getattr(script_config, 'chunk_size', 1000)),
+        prompt='Blocks placed per transaction (0 for a single transaction):',
+        title='CAD -> Revit'
+    )
+    if chunk_size is None:
+        return
+
+    try:
+        script_config.chunk_size = max(int(chunk_size), 0)
+    except ValueError:
+        forms.alert(
+            title='Error',
+            msg='Chunk size must be a whole number.'
+        )
+    else:
+        script.save_config()
+
+
+def set_level_assignment(script_config):
+    level_assignment = forms.CommandSwitchWindow.show(
+        ['Active View Level', 'Nearest Level Below Block'],
+        message='Place blocks on'
+    )
+    if not level_assignment:
+        return
+
+    script_config.level_by_elevation = \
+        level_assignment == 'Nearest Level Below Block'
+    script.save_config()
+
+
 def draw_block_origins():
     from Autodesk.Revit.DB import XYZ
 
     import rpw
-    from boostutils import draw_circle
+    from boostutils import DebugOverlay
     from gather import get_blocks, get_cad_imports
 
     doc = rpw.revit.doc
@@ -31,30 +68,47 @@ def draw_block_origins():
         cad_import = forms.SelectFromList.show(
             title='Select CAD Import to Map to Revit',
             context=cad_imports,
-            name_attr='Name'
+            name_attr='name'
         )
     else:
         [cad_import] = cad_imports
 
     if not cad_import:
         sys.exit()
+    else:
+        cad_import = cad_import._import   # we no longer care about name
 
     import_transform = cad_import.GetTotalTransform()
-    blocks = get_blocks(cad_import)
+    blocks = get_blocks(cad_import) or []
 
+    overlay = DebugOverlay(doc, max_shapes=MAX_BLOCK_ORIGINS)
+    for b in blocks:
+        overlay.add_circle(
+            center=import_transform.Multiply(b.Transform).OfPoint(XYZ.Zero),
+            radius=0.25,
+            view=view
+        )
+
+    total = len(overlay)
     with rpw.db.Transaction('Draw locations', doc=doc):
-        for b in blocks:
-            draw_circle(
-              center=import_transform.Multiply(b.Transform).OfPoint(XYZ.Zero),
-              radius=0.25,
-              view=view,
-              doc=doc
-            )
+        cnt = overlay.draw()
+
+    if cnt < total:
+        forms.alert(
+            title='Draw Block Origins',
+            msg='Drew {} of {} block origins.'.format(cnt, total),
+            warn_icon=False
+        )
 
 
 if __name__ == '__main__':
     cmd = forms.CommandSwitchWindow.show(
-        context=['Edit Configuration', 'Draw Block Origins']
+        context=[
+            'Edit Configuration',
+            'Draw Block Origins',
+            'Set Chunk Size',
+            'Set Level Assignment'
+        ]
     )
 
     if cmd == 'Edit Configuration':
@@ -70,3 +124,11 @@ if __name__ == '__main__':
             )
     elif cmd == 'Draw Block Origins':
         draw_block_origins()
+    elif cmd == 'Set Chunk Size':
+        set_chunk_size(
+            script.get_config(section='pyRevitBoost.General.CADToRevit')
+        )
+    elif cmd == 'Set Level Assignment':
+        set_level_assignment(
+            script.get_config(section='pyRevitBoost.General.CADToRevit')
+        )
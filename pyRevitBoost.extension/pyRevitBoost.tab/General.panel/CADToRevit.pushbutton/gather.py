@@ -1,10 +1,14 @@
 # pylint: disable=import-error
-from Autodesk.Revit.DB import (GeometryInstance, HostObjectUtils, Options,
+from Autodesk.Revit.DB import (GeometryInstance, HostObjectUtils,
+                               LocationCurve, Options, PlanarFace,
                                ShellLayerType, XYZ)
 
 from rpw.db import Collector
 
-from boostutils import get_name, memoize
+from boostutils import (FamilyTypeIndex, get_document_token, get_name,
+                        memoize)
+from index import (ElevationIndex, GridIndex, closest_point_on_loops,
+                   distance_to_segment, point_in_polygon, suggest_cell_size)
 from parse import parse_block_name
 
 
@@ -16,18 +20,31 @@ class _cad_import():
 
 
 def find_family_type(category, family, family_type):
-    family_types = get_family_types()
-    [typeToPlace] = [
-        t for t in family_types
-        if t.Category.Name == category
-        and t.FamilyName == family
-        and get_name(t) == family_type
-    ]
-    return typeToPlace
+    return get_family_type_index().find(category, family, family_type)
+
+
+def find_level_below(elevation):
+    return get_level_index().below(elevation)
 
 
-def find_nearest_ceiling_face(location, tolerance=1e-9):
-    ceiling_face_refs = get_ceiling_faces()
+def find_nearest_ceiling_face(location, tolerance=1e-9, use_index=True):
+    if use_index:
+        candidates = get_ceiling_face_index().query_point(
+            location.X,
+            location.Y
+        )
+    else:
+        # Linear scan over every face, kept for checking the index
+        candidates = [
+            (
+                ceiling,
+                face_ref,
+                ceiling.GetGeometryObjectFromReference(face_ref),
+                None
+            )
+            for ceiling, face_refs in get_ceiling_faces()
+            for face_ref in face_refs
+        ]
 
     nearest = {
         'ceiling': None,
@@ -37,30 +54,29 @@ def find_nearest_ceiling_face(location, tolerance=1e-9):
         'uv': None,
         'distance': None
     }
-    for ceiling, face_refs in ceiling_face_refs:
-        for face_ref in face_refs:
-            face = ceiling.GetGeometryObjectFromReference(face_ref)
-
+    for ceiling, face_ref, face, outline in candidates:
+        if outline:
+            (point, uv, distance) = project_onto_outline(outline, location)
+        else:
             projection = face.Project(location)
-            if projection:
-                distance = projection.Distance
-                uv = projection.UVPoint
-                point = projection.XYZPoint
-
-                if (
-                    all(v is None for v in nearest.values())
-                    or distance < nearest['distance']
-                ):
-                    nearest = {
-                        'ceiling': ceiling,
-                        'face_ref': face_ref,
-                        'face': face,
-                        'point': point,
-                        'uv': uv,
-                        'distance': distance
-                    }
-
-    if any(v is None for v in nearest.values()):
+            if not projection:
+                continue
+
+            distance = projection.Distance
+            uv = projection.UVPoint
+            point = projection.XYZPoint
+
+        if nearest['distance'] is None or distance < nearest['distance']:
+            nearest = {
+                'ceiling': ceiling,
+                'face_ref': face_ref,
+                'face': face,
+                'point': point,
+                'uv': uv,
+                'distance': distance
+            }
+
+    if nearest['distance'] is None:
         return None
     else:
         direction = nearest['point'] - location
@@ -68,8 +84,21 @@ def find_nearest_ceiling_face(location, tolerance=1e-9):
         return nearest if isDirectlyAbove else None
 
 
-def find_nearest_wall_face(location, tolerance):
-    wall_face_refs = get_wall_faces()
+def find_nearest_wall_face(location, tolerance, use_index=True):
+    if use_index:
+        candidates = find_walls_within(location, tolerance)
+    else:
+        # Linear scan over every face, kept for checking the index
+        candidates = [
+            (
+                wall,
+                [
+                    (face_ref, wall.GetGeometryObjectFromReference(face_ref))
+                    for face_ref in face_refs
+                ]
+            )
+            for wall, face_refs in get_wall_faces()
+        ]
 
     nearest = {
         'wall': None,
@@ -79,10 +108,8 @@ def find_nearest_wall_face(location, tolerance):
         'uv': None,
         'distance': None
     }
-    for wall, face_refs in wall_face_refs:
-        for face_ref in face_refs:
-            face = wall.GetGeometryObjectFromReference(face_ref)
-
+    for wall, faces in candidates:
+        for face_ref, face in faces:
             projection = face.Project(location)
             if projection:
                 distance = projection.Distance
@@ -108,6 +135,32 @@ def find_nearest_wall_face(location, tolerance):
     return nearest if not any(v is None for v in nearest.values()) else None
 
 
+def find_walls_within(location, tolerance):
+    (index, wall_faces, unindexed) = get_wall_segment_index()
+
+    # Walls that could not be indexed are always candidates
+    walls = set(unindexed)
+    for key, segment, width in index.query_radius(
+        location.X,
+        location.Y,
+        tolerance
+    ):
+        if key in walls:
+            continue
+
+        # Walls without a location curve are always candidates
+        if segment is None:
+            walls.add(key)
+            continue
+
+        (x0, y0, x1, y1) = segment
+        distance = distance_to_segment(location.X, location.Y, x0, y0, x1, y1)
+        if distance - width <= tolerance:
+            walls.add(key)
+
+    return [wall_faces[key] for key in sorted(walls)]
+
+
 def find_reference_plane(name):
     reference_planes = get_reference_planes()
     try:
@@ -148,12 +201,12 @@ def get_cad_imports():
     ]
 
 
-@memoize
+@memoize(invalidate=get_document_token)
 def get_ceilings():
     return Collector(of_class='Ceiling').get_elements(wrapped=False)
 
 
-@memoize
+@memoize(invalidate=get_document_token)
 def get_ceiling_faces():
     ceilings = get_ceilings()
 
@@ -169,22 +222,106 @@ def get_ceiling_faces():
     return zip(ceilings, face_refs)
 
 
-@memoize
+@memoize(invalidate=get_document_token)
+def get_ceiling_face_index():
+    faces, extents = [], []
+    for ceiling, face_refs in get_ceiling_faces():
+        for face_ref in face_refs:
+            face = ceiling.GetGeometryObjectFromReference(face_ref)
+            loops = get_face_loops(face)
+            outline = get_face_outline(face, loops)
+            faces.append((ceiling, face_ref, face, outline))
+            extents.append(get_loop_extents(loops))
+
+    index = GridIndex(cell_size=suggest_cell_size(extents))
+    for face, (min_x, min_y, max_x, max_y) in zip(faces, extents):
+        index.insert(face, min_x, min_y, max_x, max_y)
+
+    return index
+
+
+def get_face_loops(face):
+    return [
+        [
+            point
+            for curve in curve_loop
+            for point in list(curve.Tessellate())[:-1]
+        ]
+        for curve_loop in face.GetEdgesAsCurveLoops()
+    ]
+
+
+def get_loop_extents(loops):
+    points = [point for loop in loops for point in loop]
+    return (
+        min(p.X for p in points),
+        min(p.Y for p in points),
+        max(p.X for p in points),
+        max(p.Y for p in points)
+    )
+
+
+# Horizontal planar faces are reduced to their elevation and XY edge loops,
+# so hosting can skip face.Project. Sloped and curved faces return None.
+def get_face_outline(face, loops, tolerance=1e-9):
+    if not isinstance(face, PlanarFace):
+        return None
+    if abs(face.FaceNormal.Z) < 1 - tolerance:
+        return None
+
+    return (
+        face.Origin.Z,
+        [[(p.X, p.Y) for p in loop] for loop in loops if len(loop) > 2]
+    )
+
+
+# Matches face.Project: straight up or down when the location is over the
+# face, otherwise to the nearest point on its edges
+def project_onto_outline(outline, location):
+    (z, loops) = outline
+    if point_in_polygon(location.X, location.Y, loops):
+        (x, y) = (location.X, location.Y)
+    else:
+        (x, y) = closest_point_on_loops(location.X, location.Y, loops)
+
+    point = XYZ(x, y, z)
+    return (point, None, point.DistanceTo(location))
+
+
+@memoize(invalidate=get_document_token)
 def get_family_types():
     return Collector(of_class='FamilySymbol').get_elements(wrapped=False)
 
 
-@memoize
+@memoize(invalidate=get_document_token)
+def get_family_type_index():
+    return FamilyTypeIndex(get_family_types())
+
+
+@memoize(invalidate=get_document_token)
+def get_levels():
+    return Collector(of_class='Level').get_elements(wrapped=False)
+
+
+@memoize(invalidate=get_document_token)
+def get_level_index():
+    return ElevationIndex([
+        (level.ProjectElevation, level)
+        for level in get_levels()
+    ])
+
+
+@memoize(invalidate=get_document_token)
 def get_reference_planes():
     return Collector(of_class='ReferencePlane').get_elements(wrapped=False)
 
 
-@memoize
+@memoize(invalidate=get_document_token)
 def get_walls():
     return Collector(of_class='Wall').get_elements(wrapped=False)
 
 
-@memoize
+@memoize(invalidate=get_document_token)
 def get_wall_faces():
     # .NET stuff
     slt_exterior = getattr(ShellLayerType, 'Exterior')
@@ -205,10 +342,60 @@ def get_wall_faces():
     return zip(walls, face_refs)
 
 
+@memoize(invalidate=get_document_token)
+def get_wall_segment_index():
+    wall_faces, items, extents, unindexed = [], [], [], []
+    for key, (wall, face_refs) in enumerate(get_wall_faces()):
+        wall_faces.append((
+            wall,
+            [
+                (face_ref, wall.GetGeometryObjectFromReference(face_ref))
+                for face_ref in face_refs
+            ]
+        ))
+
+        # Side faces lie within the wall width of its location curve,
+        # which need not be the wall centerline
+        width = wall.Width
+        location = wall.Location
+        if isinstance(location, LocationCurve):
+            points = list(location.Curve.Tessellate())
+            for p0, p1 in zip(points[:-1], points[1:]):
+                items.append((key, (p0.X, p0.Y, p1.X, p1.Y), width))
+                extents.append((
+                    min(p0.X, p1.X) - width,
+                    min(p0.Y, p1.Y) - width,
+                    max(p0.X, p1.X) + width,
+                    max(p0.Y, p1.Y) + width
+                ))
+        else:
+            box = wall.get_BoundingBox(None)
+            if box is None:
+                unindexed.append(key)
+                continue
+
+            items.append((key, None, width))
+            extents.append((box.Min.X, box.Min.Y, box.Max.X, box.Max.Y))
+
+    index = GridIndex(cell_size=suggest_cell_size(extents))
+    for item, (min_x, min_y, max_x, max_y) in zip(items, extents):
+        index.insert(item, min_x, min_y, max_x, max_y)
+
+    return (index, wall_faces, unindexed)
+
+
 def group_blocks_by_name(blocks):
+    # Instances share a handful of symbols, so each symbol name is only
+    # looked up and parsed once
+    block_names = {}
     blocks_grouped_by_name = {}
     for block in blocks:
-        block_name = parse_block_name(get_name(block.Symbol))
+        symbol = block.Symbol
+        symbol_id = symbol.Id.IntegerValue
+        if symbol_id not in block_names:
+            block_names[symbol_id] = parse_block_name(get_name(symbol))
+        block_name = block_names[symbol_id]
+
         if block_name not in blocks_grouped_by_name:
             blocks_grouped_by_name[block_name] = [block]
         else:
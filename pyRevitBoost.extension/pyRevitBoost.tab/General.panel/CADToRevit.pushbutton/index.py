@@ -0,0 +1,130 @@
+import bisect
+import math
+
+
+# Uniform XY grid. Items are bucketed into every cell their extents
+# overlap, so a query only looks at the few items sharing its cells.
+class GridIndex(object):
+    def __init__(self, cell_size):
+        if not cell_size > 0:
+            raise ValueError('Cell size must be positive')
+
+        self.cell_size = float(cell_size)
+        self._cells = {}
+        self._items = []
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def _cell(self, x, y):
+        return (
+            int(math.floor(x / self.cell_size)),
+            int(math.floor(y / self.cell_size))
+        )
+
+    def _cells_in(self, min_x, min_y, max_x, max_y):
+        (i0, j0) = self._cell(min_x, min_y)
+        (i1, j1) = self._cell(max_x, max_y)
+        for i in range(i0, i1+1):
+            for j in range(j0, j1+1):
+                yield (i, j)
+
+    def insert(self, item, min_x, min_y, max_x, max_y):
+        key = len(self._items)
+        self._items.append(item)
+        for cell in self._cells_in(min_x, min_y, max_x, max_y):
+            if cell not in self._cells:
+                self._cells[cell] = [key]
+            else:
+                self._cells[cell].append(key)
+
+    def query_point(self, x, y):
+        return [self._items[k] for k in self._cells.get(self._cell(x, y), [])]
+
+    def query_box(self, min_x, min_y, max_x, max_y):
+        keys = set()
+        for cell in self._cells_in(min_x, min_y, max_x, max_y):
+            keys.update(self._cells.get(cell, []))
+
+        return [self._items[k] for k in sorted(keys)]
+
+    def query_radius(self, x, y, radius):
+        return self.query_box(x-radius, y-radius, x+radius, y+radius)
+
+
+# Items sorted by elevation. An elevation belongs to the highest item at or
+# below it, or to the lowest item when it is below them all.
+class ElevationIndex(object):
+    def __init__(self, items):
+        items = sorted(items, key=lambda item: item[0])
+        self._elevations = [elevation for (elevation, _) in items]
+        self._items = [item for (_, item) in items]
+
+    def __len__(self):
+        return len(self._items)
+
+    def below(self, elevation, tolerance=1e-6):
+        if not self._items:
+            return None
+
+        i = bisect.bisect_right(self._elevations, elevation + tolerance)
+        return self._items[max(i-1, 0)]
+
+
+def distance_to_segment(x, y, x0, y0, x1, y1):
+    (cx, cy) = closest_point_on_segment(x, y, x0, y0, x1, y1)
+    return math.hypot(x - cx, y - cy)
+
+
+def closest_point_on_segment(x, y, x0, y0, x1, y1):
+    dx, dy = x1 - x0, y1 - y0
+    length_squared = dx*dx + dy*dy
+    if length_squared == 0:
+        return (x0, y0)
+
+    t = ((x - x0)*dx + (y - y0)*dy) / length_squared
+    t = max(0.0, min(1.0, t))
+    return (x0 + t*dx, y0 + t*dy)
+
+
+# Even-odd rule over every loop, so holes in a face are excluded
+def point_in_polygon(x, y, loops):
+    inside = False
+    for loop in loops:
+        (x0, y0) = loop[-1]
+        for (x1, y1) in loop:
+            if (y1 > y) != (y0 > y):
+                if x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+                    inside = not inside
+            (x0, y0) = (x1, y1)
+
+    return inside
+
+
+def closest_point_on_loops(x, y, loops):
+    nearest, nearest_distance = None, None
+    for loop in loops:
+        (x0, y0) = loop[-1]
+        for (x1, y1) in loop:
+            (cx, cy) = closest_point_on_segment(x, y, x0, y0, x1, y1)
+            distance = math.hypot(x - cx, y - cy)
+            if nearest is None or distance < nearest_distance:
+                nearest, nearest_distance = (cx, cy), distance
+            (x0, y0) = (x1, y1)
+
+    return nearest
+
+
+# Average item width/height, so most items span only a few cells
+def suggest_cell_size(extents, minimum=1.0):
+    if not extents:
+        return minimum
+
+    total = sum(
+        (max_x - min_x) + (max_y - min_y)
+        for (min_x, min_y, max_x, max_y) in extents
+    )
+    return max(total / (2.0 * len(extents)), minimum)
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 # pylint: disable=import-error
-import re
 import math
+import os
+import re
 
 from Autodesk.Revit.DB import Transform, UnitFormatUtils, UnitType, XYZ
 
@@ -14,40 +15,70 @@ regex = {
 }
 
 
-def parse_config(block_name, config, doc):
-    [mapping] = [
-        mapping for mapping in config
-        if mapping.get('block') == block_name
-    ]
+def get_config_cache_path(config_file):
+    return os.path.splitext(config_file)[0] + '.cache.json'
+
+
+def compile_config(config, doc):
+    rows_by_block = {}
+    for row in config:
+        block_name = row.get('block')
+        if block_name not in rows_by_block:
+            rows_by_block[block_name] = [row]
+        else:
+            rows_by_block[block_name].append(row)
+
+    mappings, errors = {}, []
+    for block_name, rows in rows_by_block.items():
+        if not block_name:
+            # Ignore blank lines
+            if any(v for row in rows for v in row.values()):
+                errors.append(('', 'Missing block name'))
+            continue
 
+        if len(rows) > 1:
+            errors.append((
+                block_name,
+                'Block is mapped by {} rows'.format(len(rows))
+            ))
+            continue
+
+        try:
+            mappings[block_name] = parse_mapping(rows[0], doc)
+        except ValueError as e:
+            errors.append((block_name, str(e)))
+
+    return (mappings, sorted(errors))
+
+
+def parse_mapping(mapping, doc):
     # Ensure required fields
-    if not (
-        mapping.get('host')
-        and mapping.get('category')
-        and mapping.get('family')
-        and mapping.get('host')
-    ):
-        raise ValueError
+    missing = [
+        field for field in ('host', 'category', 'family')
+        if not mapping.get(field)
+    ]
+    if missing:
+        raise ValueError('Missing {}'.format(', '.join(missing)))
 
     # GSheets strips spaces (families with only one type)
-    if not mapping.get('type'):
-        mapping['type'] = ' '
+    type_name = mapping.get('type') or ' '
 
     # Parse config
     from gather import find_family_type
-    host = parse_host(mapping.get('host'), doc.GetUnits())
+    units = doc.GetUnits()
+    host = parse_host(mapping.get('host'), units)
     if mapping.get('backup-host'):
-        backup_host = parse_host(mapping.get('backup-host'), doc.GetUnits())
+        backup_host = parse_host(mapping.get('backup-host'), units)
     else:
         backup_host = None
     family_type = find_family_type(
         category=mapping.get('category'),
         family=mapping.get('family'),
-        family_type=mapping.get('type')
+        family_type=type_name
     )
     origin_offset = parse_origin_offset(
         offset=mapping.get('origin-offset'),
-        units=doc.GetUnits()
+        units=units
     )
     orientation_offset = parse_orientation_offset(
         offset=mapping.get('orientation-offset')
@@ -55,27 +86,22 @@ def parse_config(block_name, config, doc):
     rotate_origin_offset = parse_orientation_offset(
         offset=mapping.get('rotate-origin-offset')
     )
-    parameters = mapping.get('parameters')
-
-    map = {
-        'family_type': family_type,
-        'host': host,
-        'backup_host': backup_host,
-        'origin_offset': origin_offset,
-        'rotate_origin_offset': rotate_origin_offset,
-        'orientation_offset': orientation_offset,
-        'parameters': parameters
-    }
+    parameters = mapping.get('parameters') or {}
 
     # Apply rotate_origin_offset
     rotation = Transform.CreateRotation(
         XYZ.BasisZ,
         rotate_origin_offset
     )
-    map['origin_offset'] = rotation.OfVector(origin_offset)
 
-    family_type.Activate()  # Revit doesn't allow placing inactive families
-    return map
+    return {
+        'family_type': family_type,
+        'host': host,
+        'backup_host': backup_host,
+        'origin_offset': rotation.OfVector(origin_offset),
+        'orientation_offset': orientation_offset,
+        'parameters': parameters
+    }
 
 
 def parse_block_name(block):
@@ -90,12 +116,15 @@ def parse_host(host, units):
     results = regex['host'].match(host)
 
     if not results:
-        raise ValueError('Could not find host {}'.format(host))
+        raise ValueError('Could not parse host {}'.format(host))
 
     type_ = results.group('type')
     param = results.group('param')
 
     if type_ == 'Wall' or type_ == 'Wall and Level':
+        if not param:
+            raise ValueError('Missing tolerance for host {}'.format(host))
+
         (succeeded, tolerance) = UnitFormatUtils.TryParse(
             units,
             UnitType.UT_Length,
@@ -103,7 +132,7 @@ def parse_host(host, units):
         )
 
         if not succeeded:
-            raise ValueError
+            raise ValueError('Could not parse tolerance {}'.format(param))
 
         return {
             'type': type_,
@@ -140,11 +169,13 @@ def parse_origin_offset(offset, units):
 
             # Revit couldn't parse into internal units
             else:
-                raise ValueError
+                raise ValueError(
+                    'Could not parse origin offset {}'.format(offset)
+                )
 
         # We couldn't parse config 'origin-offset'
         else:
-            raise ValueError
+            raise ValueError('Could not parse origin offset {}'.format(offset))
 
     # No offset specified
     else:
@@ -166,7 +197,9 @@ def parse_orientation_offset(offset):
 
         # We couldn't parse config 'orientation-offset'
         else:
-            raise ValueError
+            raise ValueError(
+                'Could not parse orientation offset {}'.format(offset)
+            )
 
     # No offset specified
     else:
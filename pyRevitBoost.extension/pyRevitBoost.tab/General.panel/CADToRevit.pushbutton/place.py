@@ -1,162 +1,205 @@
 # pylint: disable=import-error
-from Autodesk.Revit.DB import (ElementTransformUtils, Line, Reference,
-                               StorageType, Transform, XYZ)
+from System.Collections.Generic import List
+
+from Autodesk.Revit.Creation import FamilyInstanceCreationData
+from Autodesk.Revit.DB import (BuiltInParameter, ElementId,
+                               ElementTransformUtils, Line, Reference,
+                               StorageType, SubTransaction, XYZ)
 from Autodesk.Revit.DB.Structure import StructuralType
-from Autodesk.Revit.Exceptions import ArgumentException
 
-from boostutils import get_parameter
-from gather import (find_nearest_ceiling_face, find_nearest_wall_face,
-                    find_reference_plane)
+from plan import to_xyz
+from profiler import profiler
 
 
-def map_block_to_family_instance(
-    family_type, host, backup_host,
-    origin_offset, orientation_offset,
-    parameters, block, transform,
-    doc, view, level
-):
-    block_transform = transform.Multiply(block.Transform)
+def apply_plan(placements, doc):
+    family_instances, failed = [], []
+    setter_plans = {}
+
+    # Revit doesn't allow placing inactive families
+    for family_type_id in set(p['family_type'] for p in placements):
+        family_type = doc.GetElement(ElementId(family_type_id))
+        if not family_type.IsActive:
+            family_type.Activate()
+
+    # Level hosted placements are created in one batch per type and level
+    batches = {}
+    for placement in placements:
+        if placement['host'] == 'Level':
+            key = (placement['family_type'], placement['level'])
+            if key not in batches:
+                batches[key] = [placement]
+            else:
+                batches[key].append(placement)
+        else:
+            # A failed placement is rolled back so that no partly placed
+            # instance is left behind to be duplicated on resume
+            st = SubTransaction(doc)
+            st.Start()
+            try:
+                family_instances.append(
+                    apply_placement(placement, doc, setter_plans)
+                )
+            except Exception as e:
+                st.RollBack()
+                failed.append((placement, describe_failure(e)))
+            else:
+                st.Commit()
+
+    for batch in batches.values():
+        try:
+            batch_instances = apply_placements_on_level(batch, doc)
+        except Exception as e:
+            failed.extend(
+                (placement, describe_failure(e)) for placement in batch
+            )
+            continue
+
+        level = doc.GetElement(ElementId(batch[0]['level']))
+        for family_instance, placement in zip(batch_instances, batch):
+            try:
+                finish_family_instance(
+                    family_instance,
+                    level,
+                    placement['parameters'],
+                    setter_plans
+                )
+            except Exception as e:
+                doc.Delete(family_instance.Id)
+                failed.append((placement, describe_failure(e)))
+            else:
+                family_instances.append(family_instance)
+
+    for placement, reason in failed:
+        profiler.fail(placement['block'], reason)
+
+    return (family_instances, failed)
+
+
+def describe_failure(e):
+    return '{}: {}'.format(type(e).__name__, e)
 
-    block_direction = block_transform.OfVector(XYZ.BasisX)
-    block_orientation = XYZ.BasisX.AngleTo(block_direction)
-    block_rotation = Transform.CreateRotation(
-        XYZ.BasisZ,
-        block_orientation
-    )
 
-    block_location = block_transform.OfPoint(XYZ.Zero)
-    rotated_origin_offset = block_rotation.OfVector(origin_offset)
-    location = block_location - rotated_origin_offset
+def apply_placement(placement, doc, setter_plans=None):
+    family_type = doc.GetElement(ElementId(placement['family_type']))
+    level = doc.GetElement(ElementId(placement['level']))
+    point = to_xyz(placement['point'])
 
     # Place family instance
-    if host['type'] == 'Ceiling':
-        ceiling = find_nearest_ceiling_face(location=location)
-        if ceiling:
-            family_instance = place_on_ceiling(
+    with profiler.stage('element creation'):
+        if placement['host'] == 'Level':
+            family_instance = place_on_level(
                 family_type,
-                ceiling,
                 level,
+                point,
                 doc
             )
-        elif backup_host:
-            map_block_to_family_instance(
-                family_type, backup_host, None,
-                origin_offset, orientation_offset,
-                parameters, block, transform,
-                doc, view, level
-            )
-            return
-        else:
-            raise TypeError
-    elif host['type'] == 'Reference Plane':
-        reference_plane = find_reference_plane(name=host['id'])
-        family_instance = place_on_reference_plane(
-            family_type,
-            reference_plane,
-            location,
-            doc
-        )
-    elif host['type'] == 'Level':
-        family_instance = place_on_level(
-            family_type,
-            level,
-            location,
-            doc
-        )
-    elif host['type'] == 'Wall':
-        wall = find_nearest_wall_face(
-            location=location,
-            tolerance=host['tolerance']
-        )
-        if wall:
-            family_instance = place_on_wall(
+        elif placement['host'] == 'Wall and Level':
+            family_instance = place_on_wall_and_level(
                 family_type,
-                wall,
-                level,
+                doc.GetElement(ElementId(placement['host_element'])),
+                point,
+                to_xyz(placement['direction']),
                 doc
             )
-        elif backup_host:
-            map_block_to_family_instance(
-                family_type, backup_host, None,
-                origin_offset, orientation_offset,
-                parameters, block, transform,
-                doc, view, level
-            )
-            return
         else:
-            raise TypeError
-    elif host['type'] == 'Wall and Level':
-        wall = find_nearest_wall_face(
-            location=location,
-            tolerance=host['tolerance']
-        )
-        if wall:
-            family_instance = place_on_wall_and_level(
+            family_instance = place_on_face(
                 family_type,
-                wall,
-                level,
+                Reference.ParseFromStableRepresentation(
+                    doc,
+                    placement['face_ref']
+                ),
+                point,
+                to_xyz(placement['direction']),
                 doc
             )
-        elif backup_host:
-            map_block_to_family_instance(
-                family_type, backup_host, None,
-                origin_offset, orientation_offset,
-                parameters, block, transform,
-                doc, view, level
-            )
-            return
-        else:
-            raise TypeError
 
     # Rotate family instance into alignment with block
-    if (
-        host['type'] == 'Ceiling'
-        or host['type'] == 'Reference Plane'
-        or host['type'] == 'Level'
-    ):
-        z_axis = Line.CreateBound(location, location + XYZ.BasisZ)
-        ElementTransformUtils.RotateElement(
-            doc,
-            family_instance.Id,
-            z_axis,
-            block_orientation + orientation_offset
-        )
+    if placement['rotation']:
+        axis = to_xyz(placement['axis'])
+        with profiler.stage('rotation'):
+            ElementTransformUtils.RotateElement(
+                doc,
+                family_instance.Id,
+                Line.CreateBound(axis, axis + XYZ.BasisZ),
+                placement['rotation']
+            )
 
-    # Set schedule level to allow changing elevation
-    schedule_level = get_parameter(
-        el=family_instance,
-        builtin='INSTANCE_SCHEDULE_ONLY_LEVEL_PARAM'
+    finish_family_instance(
+        family_instance,
+        level,
+        placement['parameters'],
+        setter_plans
     )
-    schedule_level.Set(level.Id)
+    return family_instance
 
-    # Set family instance parameters
-    set_parameters(
-        el=family_instance,
-        parameters=parameters
-    )
 
-    return family_instance
+def apply_placements_on_level(placements, doc):
+    if not placements:
+        return []
 
+    family_type = doc.GetElement(ElementId(placements[0]['family_type']))
+    level = doc.GetElement(ElementId(placements[0]['level']))
 
-def place_on_ceiling(family_type, ceiling, level, doc):
-    direction = XYZ.BasisX.CrossProduct(ceiling['face'].FaceNormal)
+    # Rotation is applied on creation
+    with profiler.stage('element creation', count=len(placements)):
+        family_instances = place_on_level_batch(
+            family_type,
+            level,
+            [
+                (to_xyz(placement['point']), placement['rotation'])
+                for placement in placements
+            ],
+            doc
+        )
+
+    return family_instances
+
+
+def finish_family_instance(
+    family_instance, level, parameters, setter_plans=None
+):
+    with profiler.stage('parameters'):
+        # Set schedule level to allow changing elevation
+        family_instance.get_Parameter(
+            BuiltInParameter.INSTANCE_SCHEDULE_ONLY_LEVEL_PARAM
+        ).Set(level.Id)
+
+        # Parameters are resolved once per family type and configuration
+        setter_plans = {} if setter_plans is None else setter_plans
+        key = (
+            family_instance.Symbol.Id.IntegerValue,
+            tuple(sorted(parameters.items()))
+        )
+        if key not in setter_plans:
+            setter_plans[key] = compile_parameter_setters(
+                family_instance,
+                parameters
+            )
+        (setters, type_setters) = setter_plans[key]
+
+        # Set family instance parameters
+        set_parameters(
+            el=family_instance,
+            parameters=parameters,
+            setters=setters
+        )
+
+        # Type parameters are shared by every instance. They are set with
+        # the first instance that gets this far, and again with the next
+        # one if setting them fails.
+        if type_setters:
+            set_type_parameters(family_instance.Symbol, type_setters)
+            setter_plans[key] = (setters, [])
+
+
+def place_on_face(family_type, face_ref, point, direction, doc):
     family_instance = doc.Create.NewFamilyInstance(
-        ceiling['face_ref'],
-        ceiling['point'],
+        face_ref,
+        point,
         direction,
         family_type
     )
 
-    # Negate direction of ceiling
-    orientation = XYZ.BasisX.AngleTo(direction)
-    z_axis = Line.CreateBound(ceiling['point'], ceiling['point'] + XYZ.BasisZ)
-    ElementTransformUtils.RotateElement(
-        doc,
-        family_instance.Id,
-        z_axis,
-        -orientation
-    )
-
     return family_instance
 
 
@@ -171,78 +214,101 @@ def place_on_level(family_type, level, location, doc):
     return family_instance
 
 
-def place_on_reference_plane(family_type, reference_plane, location, doc):
-    plane = reference_plane.GetPlane()
-    direction = reference_plane.FreeEnd - reference_plane.BubbleEnd
-    offset = plane.Origin.DotProduct(plane.Normal) * plane.Normal
-    family_instance = doc.Create.NewFamilyInstance(
-        reference_plane.GetReference(),
-        location + offset,
-        direction,
-        family_type
-    )
+def place_on_level_batch(family_type, level, placements, doc):
+    creation_data = List[FamilyInstanceCreationData]()
+    for location, rotation in placements:
+        data = FamilyInstanceCreationData(
+            location,
+            family_type,
+            level,
+            StructuralType.NonStructural
+        )
+        data.Axis = Line.CreateBound(location, location + XYZ.BasisZ)
+        data.RotateAngle = rotation
+        creation_data.Add(data)
 
-    # Negate direction of reference plane
-    orientation = XYZ.BasisX.AngleTo(direction)
-    z_axis = Line.CreateBound(location, location + XYZ.BasisZ)
-    ElementTransformUtils.RotateElement(
-        doc,
-        family_instance.Id,
-        z_axis,
-        -orientation
-    )
+    if not creation_data.Count:
+        return []
 
-    return family_instance
+    family_instance_ids = doc.Create.NewFamilyInstances2(creation_data)
+    return [doc.GetElement(id_) for id_ in family_instance_ids]
 
 
-def place_on_wall(family_type, wall, level, doc):
-    direction = XYZ.BasisZ.CrossProduct(wall['face'].FaceNormal)
+def place_on_wall_and_level(family_type, wall, point, direction, doc):
     family_instance = doc.Create.NewFamilyInstance(
-        wall['face_ref'],
-        wall['point'],
+        point,
+        family_type,
         direction,
-        family_type
+        wall,
+        StructuralType.NonStructural
     )
 
     return family_instance
 
 
-def place_on_wall_and_level(family_type, wall, level, doc):
-    direction = XYZ.BasisZ.CrossProduct(wall['face'].FaceNormal)
-    family_instance = doc.Create.NewFamilyInstance(
-        wall['point'],
-        family_type,
-        direction,
-        wall['wall'],
-        StructuralType.NonStructural
-    )
+def set_parameters(el, parameters, setters=None):
+    if setters is None:
+        (setters, type_setters) = compile_parameter_setters(el, parameters)
+        if type_setters:
+            set_type_parameters(el.Symbol, type_setters)
+
+    for key, method, value in setters:
+        getattr(el.get_Parameter(key), method)(value)
 
-    return family_instance
 
+# Type parameters are set all or none
+def set_type_parameters(family_type, type_setters):
+    st = SubTransaction(family_type.Document)
+    st.Start()
+    try:
+        for key, method, value in type_setters:
+            getattr(family_type.get_Parameter(key), method)(value)
+    except Exception:
+        st.RollBack()
+        raise
+    else:
+        st.Commit()
 
-def set_parameters(el, parameters):
+
+# Resolve each configured parameter once per family type. Returns the
+# instance and the type parameter setters.
+def compile_parameter_setters(el, parameters):
+    setters, type_setters = [], []
     for name, v in parameters.items():
-        p = get_parameter(
-            el=el,
-            name=name,
-        )
+        p = el.LookupParameter(name)
+        if p:
+            _setters = setters
+        else:
+            p = el.Symbol.LookupParameter(name)
+            _setters = type_setters
 
-        if p.StorageType == StorageType.Integer:
-            if v == 'Yes' or v == 'yes' or v == 'True' or v == 'true':
-                v = 1
-            elif v == 'No' or v == 'no' or v == 'False' or v == 'false':
-                v = 0
-            else:
-                v = int(v)
-            p.Set(v)
-        elif p.StorageType == StorageType.Double:
-            try:
-                v = float(v)
-            except:
-                p.SetValueString(v)
-            else:
-                p.Set(v)
-        elif p.StorageType == StorageType.String:
-            p.Set(v)
+        if not p:
+            raise AttributeError('No parameter named {}'.format(name))
+
+        key = p.GUID if p.IsShared else p.Definition
+        (method, value) = convert_parameter_value(p.StorageType, v)
+        _setters.append((key, method, value))
+
+    return (setters, type_setters)
+
+
+def convert_parameter_value(storage_type, v):
+    if storage_type == StorageType.Integer:
+        if v == 'Yes' or v == 'yes' or v == 'True' or v == 'true':
+            v = 1
+        elif v == 'No' or v == 'no' or v == 'False' or v == 'false':
+            v = 0
+        else:
+            v = int(v)
+        return ('Set', v)
+    elif storage_type == StorageType.Double:
+        try:
+            v = float(v)
+        except ValueError:
+            return ('SetValueString', v)
         else:
-            raise TypeError
+            return ('Set', v)
+    elif storage_type == StorageType.String:
+        return ('Set', v)
+    else:
+        raise TypeError
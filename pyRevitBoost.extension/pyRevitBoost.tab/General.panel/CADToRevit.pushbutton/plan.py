@@ -0,0 +1,169 @@
+# pylint: disable=import-error
+import codecs
+import json
+
+from Autodesk.Revit.DB import XYZ
+
+from gather import (find_nearest_ceiling_face, find_nearest_wall_face,
+                    find_reference_plane)
+from profiler import profiler
+from transforms import block_locations, to_block_matrix, to_matrix
+
+PLAN_VERSION = 1
+
+
+def plan_block(
+    family_type, host, backup_host,
+    origin_offset, orientation_offset,
+    parameters, block, transform,
+    doc, level, block_name=None, index=None, block_location=None
+):
+    if block_location is None:
+        [block_location] = get_block_locations(
+            [block],
+            transform,
+            origin_offset
+        )
+    (location, block_orientation) = block_location
+
+    placement = {
+        'block': block_name,
+        'index': index,
+        'family_type': family_type.Id.IntegerValue,
+        'host': host['type'],
+        'host_element': None,
+        'face_ref': None,
+        'point': None,
+        'direction': None,
+        'axis': to_list(location),
+        'rotation': 0.0,
+        'level': level.Id.IntegerValue,
+        'parameters': dict(parameters)
+    }
+
+    # Resolve host
+    with profiler.stage('host resolution: {}'.format(host['type'])):
+        resolved = resolve_host(host, location, doc)
+
+    if resolved:
+        placement.update(resolved)
+    elif backup_host:
+        return plan_block(
+            family_type, backup_host, None,
+            origin_offset, orientation_offset,
+            parameters, block, transform,
+            doc, level, block_name, index, block_location
+        )
+    else:
+        raise TypeError('No {} host found'.format(host['type'].lower()))
+
+    # Rotate family instance into alignment with block
+    if (
+        host['type'] == 'Ceiling'
+        or host['type'] == 'Reference Plane'
+        or host['type'] == 'Level'
+    ):
+        placement['rotation'] += block_orientation + orientation_offset
+
+    return placement
+
+
+def resolve_host(host, location, doc):
+    if host['type'] == 'Ceiling':
+        ceiling = find_nearest_ceiling_face(location=location)
+        if not ceiling:
+            return None
+
+        # Negate direction of ceiling
+        direction = XYZ.BasisX.CrossProduct(ceiling['face'].FaceNormal)
+        face_ref = ceiling['face_ref']
+        return {
+            'host_element': ceiling['ceiling'].Id.IntegerValue,
+            'face_ref': face_ref.ConvertToStableRepresentation(doc),
+            'point': to_list(ceiling['point']),
+            'direction': to_list(direction),
+            'rotation': -XYZ.BasisX.AngleTo(direction)
+        }
+    elif host['type'] == 'Reference Plane':
+        reference_plane = find_reference_plane(name=host['id'])
+        if not reference_plane:
+            return None
+
+        plane = reference_plane.GetPlane()
+        direction = reference_plane.FreeEnd - reference_plane.BubbleEnd
+        offset = plane.Origin.DotProduct(plane.Normal) * plane.Normal
+
+        # Negate direction of reference plane
+        face_ref = reference_plane.GetReference()
+        return {
+            'host_element': reference_plane.Id.IntegerValue,
+            'face_ref': face_ref.ConvertToStableRepresentation(doc),
+            'point': to_list(location + offset),
+            'direction': to_list(direction),
+            'rotation': -XYZ.BasisX.AngleTo(direction)
+        }
+    elif host['type'] == 'Level':
+        return {
+            'point': to_list(location)
+        }
+    elif host['type'] == 'Wall' or host['type'] == 'Wall and Level':
+        wall = find_nearest_wall_face(
+            location=location,
+            tolerance=host['tolerance']
+        )
+        if not wall:
+            return None
+
+        direction = XYZ.BasisZ.CrossProduct(wall['face'].FaceNormal)
+        face_ref = wall['face_ref']
+        return {
+            'host_element': wall['wall'].Id.IntegerValue,
+            'face_ref': face_ref.ConvertToStableRepresentation(doc),
+            'point': to_list(wall['point']),
+            'direction': to_list(direction)
+        }
+
+
+def get_block_locations(blocks, transform, origin_offset):
+    with profiler.stage('block locations', count=len(blocks)):
+        locations = block_locations(
+            import_matrix=to_matrix(transform),
+            block_matrices=[
+                to_block_matrix(block.Transform) for block in blocks
+            ],
+            origin_offset=(origin_offset.X, origin_offset.Y, origin_offset.Z)
+        )
+    return [
+        (XYZ(x, y, z), orientation)
+        for (x, y, z, orientation) in locations
+    ]
+
+
+def to_list(xyz):
+    return [xyz.X, xyz.Y, xyz.Z]
+
+
+def to_xyz(values):
+    return XYZ(*values)
+
+
+def write_plan(path, placements, doc):
+    plan = {
+        'version': PLAN_VERSION,
+        'document': doc.Title,
+        'placements': placements
+    }
+    with codecs.open(path, 'w', encoding='utf8') as f:
+        json.dump(plan, f, indent=1)
+
+
+def read_plan(path):
+    with codecs.open(path, 'r', encoding='utf8') as f:
+        plan = json.load(f)
+
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(
+            'Unsupported placement plan version {}'.format(plan.get('version'))
+        )
+
+    return plan['placements']
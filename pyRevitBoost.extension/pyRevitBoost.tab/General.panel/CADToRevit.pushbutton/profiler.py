@@ -0,0 +1,82 @@
+import codecs
+import json
+import math
+import os
+import time
+from contextlib import contextmanager
+
+MAX_RUNS = 100
+
+
+# Stage timings and failure reasons for one CAD -> Revit run
+class Profiler(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._stages = []
+        self._durations = {}
+        self._counts = {}
+        self._failures = {}
+
+    @contextmanager
+    def stage(self, name, count=1):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time()-start, count)
+
+    def record(self, name, duration, count=1):
+        if name not in self._durations:
+            self._stages.append(name)
+            self._durations[name] = [duration]
+            self._counts[name] = count
+        else:
+            self._durations[name].append(duration)
+            self._counts[name] += count
+
+    def fail(self, block_name, reason):
+        reasons = self._failures.setdefault(block_name, {})
+        reasons[reason] = reasons.get(reason, 0) + 1
+
+    def summary(self):
+        stages = []
+        for name in self._stages:
+            durations = sorted(self._durations[name])
+            stages.append({
+                'stage': name,
+                'calls': len(durations),
+                'count': self._counts[name],
+                'total': sum(durations),
+                'p95': durations[int(math.ceil(0.95 * len(durations))) - 1]
+            })
+
+        return {
+            'stages': stages,
+            'failures': self._failures
+        }
+
+    # Runs are appended so regressions show up across Revit versions and
+    # drawing sizes
+    def write(self, path, **run):
+        runs = []
+        if os.path.isfile(path):
+            try:
+                with codecs.open(path, 'r', encoding='utf8') as f:
+                    runs = json.load(f)
+            except ValueError:
+                runs = []
+
+        run.update(self.summary())
+        run['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        runs = (runs + [run])[-MAX_RUNS:]
+        with codecs.open(path, 'w', encoding='utf8') as f:
+            json.dump(runs, f, indent=1)
+
+
+def get_profile_path(config_file):
+    return os.path.splitext(config_file)[0] + '.profile.json'
+
+
+profiler = Profiler()
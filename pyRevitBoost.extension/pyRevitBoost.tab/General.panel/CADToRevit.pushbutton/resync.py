@@ -0,0 +1,121 @@
+# pylint: disable=import-error
+import math
+
+from Autodesk.Revit.DB import (BoundingBoxIntersectsFilter, BuiltInParameter,
+                               ElementId, FamilyInstance, FamilyInstanceFilter,
+                               FilteredElementCollector, LocationPoint,
+                               Outline, XYZ)
+
+# Instances are only scoped in plan, at any elevation
+MAX_ELEVATION = 1e5
+
+
+# Spatial hash of placed family instances keyed by family type, level and XY
+# rounded to the tolerance. A block matches an instance of its family type
+# on its level in its own or a neighbouring cell.
+class InstanceHash(object):
+    def __init__(self, tolerance):
+        if not tolerance > 0:
+            raise ValueError('Tolerance must be positive')
+
+        self.tolerance = float(tolerance)
+        self._cells = {}
+
+    def __len__(self):
+        return sum(len(instances) for instances in self._cells.values())
+
+    def _cell(self, family_type_id, level_id, x, y):
+        return (
+            family_type_id,
+            level_id,
+            int(math.floor(x / self.tolerance)),
+            int(math.floor(y / self.tolerance))
+        )
+
+    def insert(self, family_type_id, level_id, x, y, element_id):
+        cell = self._cell(family_type_id, level_id, x, y)
+        if cell not in self._cells:
+            self._cells[cell] = [(x, y, element_id)]
+        else:
+            self._cells[cell].append((x, y, element_id))
+
+    # Remove and return the nearest instance within the tolerance
+    def pop_match(self, family_type_id, level_id, x, y, tolerance=None):
+        tolerance = self.tolerance if tolerance is None else tolerance
+        reach = int(math.ceil(tolerance / self.tolerance))
+        (_, _, i, j) = self._cell(family_type_id, level_id, x, y)
+
+        nearest, nearest_cell, nearest_distance = None, None, None
+        for di in range(-reach, reach+1):
+            for dj in range(-reach, reach+1):
+                cell = (family_type_id, level_id, i+di, j+dj)
+                for instance in self._cells.get(cell, []):
+                    distance = math.hypot(instance[0] - x, instance[1] - y)
+                    if distance <= tolerance and (
+                        nearest is None or distance < nearest_distance
+                    ):
+                        nearest, nearest_cell, nearest_distance = \
+                            instance, cell, distance
+
+        if nearest is None:
+            return None
+
+        self._cells[nearest_cell].remove(nearest)
+        return nearest[2]
+
+    def remaining(self):
+        return [
+            element_id
+            for instances in self._cells.values()
+            for (_, _, element_id) in instances
+        ]
+
+
+# Instances on every level within the XY extents are hashed, or every
+# instance when there are no extents
+def hash_family_instances(family_type_ids, tolerance, doc, extents=None):
+    instance_hash = InstanceHash(tolerance)
+    if extents:
+        (min_x, min_y, max_x, max_y) = extents
+        outline = Outline(
+            XYZ(min_x, min_y, -MAX_ELEVATION),
+            XYZ(max_x, max_y, MAX_ELEVATION)
+        )
+
+    for family_type_id in family_type_ids:
+        collector = FilteredElementCollector(doc).OfClass(FamilyInstance)
+        if extents:
+            collector = collector.WherePasses(
+                BoundingBoxIntersectsFilter(outline)
+            )
+        family_instances = collector\
+            .WherePasses(FamilyInstanceFilter(doc, family_type_id))\
+            .ToElements()
+
+        for family_instance in family_instances:
+            location = family_instance.Location
+            if not isinstance(location, LocationPoint):
+                continue
+
+            instance_hash.insert(
+                family_type_id.IntegerValue,
+                get_instance_level_id(family_instance),
+                location.Point.X,
+                location.Point.Y,
+                family_instance.Id
+            )
+
+    return instance_hash
+
+
+# Face hosted instances have no level, placement sets their schedule level
+def get_instance_level_id(family_instance):
+    level_id = family_instance.LevelId
+    if level_id == ElementId.InvalidElementId:
+        parameter = family_instance.get_Parameter(
+            BuiltInParameter.INSTANCE_SCHEDULE_ONLY_LEVEL_PARAM
+        )
+        if parameter:
+            level_id = parameter.AsElementId()
+
+    return level_id.IntegerValue
@@ -2,38 +2,247 @@
 import os
 import sys
 import time
+from itertools import groupby
+from operator import itemgetter
 
+from Autodesk.Revit.DB import (Transaction, TransactionGroup,
+                               TransactionStatus)
 from Autodesk.Revit.Exceptions import ArgumentException
 
 import rpw
 from pyrevit import forms, script
-from boostutils import get_parameter, load_tsv
+from boostutils import get_parameter, invalidate_caches, load_tsv_records
 
-from parse import parse_config
-from place import map_block_to_family_instance
-from gather import (get_blocks, get_cad_imports,
+from checkpoint import (Checkpoint, chunk, get_checkpoint_key,
+                        get_checkpoint_path)
+from parse import compile_config, get_config_cache_path
+from place import apply_plan
+from plan import get_block_locations, plan_block, read_plan, write_plan
+from profiler import get_profile_path, profiler
+from resync import hash_family_instances
+from gather import (find_level_below, get_blocks, get_cad_imports,
                     get_family_types, get_reference_planes,
                     group_blocks_by_name)
 
 __doc__ = u'''\
 Map imported CAD blocks to their equivalent Revit family type. \
-Requires configuration specified in config.yaml.
+Requires configuration specified in config.yaml. Several CAD imports \
+can be selected and are mapped in one batch.
 
 Shift+Click =
     - Draw circle at block locations. Useful for setting \
 offsets in config.yaml.
     - Edit configuration file.
+    - Set number of blocks placed per transaction. Interrupted \
+runs resume after the last committed chunk.
+    - Set level assignment. Blocks are placed on the active \
+view's level or on the nearest level below each block.
+
+Modes =
+    - Place Blocks: resolve hosts and place family instances.
+    - Re-sync Blocks: place only blocks without a matching family \
+instance, and select instances whose block has moved or been deleted.
+    - Export Placement Plan: resolve hosts and write the planned \
+placements to JSON without changing the model.
+    - Apply Placement Plan: place family instances from a \
+previously exported plan.
 '''
 __title__ = u'CAD\U00002b62Revit'
 __author__ = 'Zachary Mathews'
 __cleanengine__ = True
 
+CONFIG_HEADERS = ('Block', 'Category', 'Family', 'Host')
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_RESYNC_TOLERANCE = 1.0 / 12    # 1 inch
+PLACE, RESYNC, EXPORT_PLAN, APPLY_PLAN = (
+    'Place Blocks', 'Re-sync Blocks',
+    'Export Placement Plan', 'Apply Placement Plan'
+)
+
+
+def place_in_chunks(pending, get_placements, checkpoint, cnt, total):
+    chunk_size = int(getattr(script_config, 'chunk_size', DEFAULT_CHUNK_SIZE))
+    chunks = chunk(pending, chunk_size)
+    commit_times = []
+    with forms.ProgressBar(
+        title='{value} of {max_value}',
+        step=20,
+        cancellable=True
+    ) as pb:
+        pb.update_progress(cnt, total)
+
+        # Chunks are committed separately, then assimilated into one undo
+        # item. Committed chunks are kept if a later chunk fails or is
+        # cancelled.
+        tg = TransactionGroup(doc, 'CAD -> Revit')
+        tg.Start()
+        try:
+            for n, _chunk in enumerate(chunks):
+                if pb.cancelled:
+                    break
+
+                t = Transaction(doc, 'CAD -> Revit ({} of {})'.format(
+                    n+1,
+                    len(chunks)
+                ))
+                t.Start()
+                try:
+                    placements = []
+                    for block_name, items in groupby(
+                        _chunk,
+                        key=itemgetter(0)
+                    ):
+                        placements.extend(
+                            get_placements(block_name, list(items))
+                        )
+
+                    # Applied in one pass, so level hosted placements are
+                    # batched by family type and level across block groups
+                    (_, _failed) = apply_plan(placements, doc)
+                    chunk_failed = [
+                        (p['block'], p['index'], reason)
+                        for (p, reason) in _failed
+                    ]
+                    cnt += len(_chunk)
+                    pb.update_progress(cnt, total)
+                except Exception:
+                    t.RollBack()
+                    raise
+
+                commit_start = time.time()
+                status = t.Commit()
+                commit_times.append(time.time()-commit_start)
+                profiler.record('commit', commit_times[-1], count=len(_chunk))
+
+                # Nothing from a chunk that failed to commit was placed
+                if status != TransactionStatus.Committed:
+                    reason = 'Transaction {}'.format(status)
+                    chunk_failed = [
+                        (block_name, i, reason)
+                        for (block_name, i, _) in _chunk
+                    ]
+                    for (block_name, _, _) in _chunk:
+                        profiler.fail(block_name, reason)
+                failed.extend(chunk_failed)
+
+                # Failed blocks are retried when resuming
+                failed_blocks = set((name, i) for (name, i, _) in failed)
+                for block_name, items in groupby(_chunk, key=itemgetter(0)):
+                    checkpoint.mark_done(
+                        block_name,
+                        [
+                            i for (_, i, _) in items
+                            if (block_name, i) not in failed_blocks
+                        ]
+                    )
+                checkpoint.save()
+        finally:
+            tg.Assimilate()
+
+    # Every block was placed, nothing left to resume
+    if len(chunks) == len(commit_times) and not failed:
+        checkpoint.clear()
+
+    return (cnt, commit_times)
+
+
+def resume(checkpoint):
+    if len(checkpoint):
+        _resume = forms.alert(
+            title='CAD -> Revit',
+            msg='Resume previous run?',
+            sub_msg='{} blocks were placed before it was interrupted.'
+                    .format(len(checkpoint)),
+            ok=False,
+            yes=True,
+            no=True,
+            warn_icon=False
+        )
+        if not _resume:
+            checkpoint.clear()
+
+
 doc = rpw.revit.doc
 uidoc = rpw.revit.uidoc
 view = uidoc.ActiveView
 level = view.GenLevel
 
+# Host and family type caches are only valid for the same document state
+invalidate_caches()
+
+mode = forms.CommandSwitchWindow.show(
+    [PLACE, RESYNC, EXPORT_PLAN, APPLY_PLAN],
+    message='Select mode'
+)
+if not mode:
+    sys.exit()
+
 script_config = script.get_config(section='pyRevitBoost.General.CADToRevit')
+profiler.reset()
+failed = []
+
+# Multi-level imports are split across levels by block elevation
+level_by_elevation = bool(getattr(script_config, 'level_by_elevation', False))
+if mode != APPLY_PLAN and not level_by_elevation and not level:
+    forms.alert(
+        title='No level',
+        msg='The active view has no level. Open a plan view or place '
+            'blocks on the nearest level below them (Shift+Click).'
+    )
+    sys.exit()
+
+if mode == APPLY_PLAN:
+    with forms.WarningBar(title='Please select a placement plan'):
+        plan_file = forms.pick_file(
+            files_filter='Placement Plan (*.json)|*.json',
+            restore_dir=True
+        )
+    if not plan_file:
+        sys.exit()
+
+    checkpoint = Checkpoint.load(
+        path=get_checkpoint_path(plan_file),
+        key=get_checkpoint_key(doc, None, plan_file)
+    )
+    resume(checkpoint)
+
+    start_time = time.time()
+    placements = read_plan(plan_file)
+    pending = [
+        (placement['block'], placement['index'], placement)
+        for placement in placements
+        if not checkpoint.is_done(placement['block'], placement['index'])
+    ]
+    resumed = len(placements) - len(pending)
+    (cnt, commit_times) = place_in_chunks(
+        pending,
+        get_placements=lambda _, items: [p for (_, _, p) in items],
+        checkpoint=checkpoint,
+        cnt=resumed,
+        total=len(placements)
+    )
+    profiler.write(
+        get_profile_path(plan_file),
+        document=doc.Title,
+        revit=doc.Application.VersionNumber,
+        mode=mode,
+        blocks=len(placements),
+        seconds=time.time()-start_time
+    )
+
+    forms.alert(
+        title='Results',
+        msg=(
+            ('Resumed after {} previously placed elements.\n'
+             .format(resumed) if resumed else '') +
+            'Placed {0} elements in {1:4} seconds.\n'
+            .format(cnt-resumed-len(failed), time.time()-start_time) +
+            'Failed to place {} elements.'.format(len(failed))
+        ),
+        warn_icon=False
+    )
+    sys.exit()
+
 reuse_config = False
 if hasattr(script_config, 'config_file'):
     config_file=script_config.config_file
@@ -56,31 +265,45 @@ if not reuse_config:
 if not config_file:
     sys.exit()
 
-config = []
-lines = load_tsv(config_file)
-headers = lines[0]
-parameter_headers = ['Parameter', 'Value']
-for line in lines[1:]:
-    d = {}
-
-    for i, v in enumerate(line):
-        if headers[i] in parameter_headers:
-            break
-
-        d[headers[i].lower()] = v
-
-    params = {}
-    for j in range(i, len(line)-1, len(parameter_headers)):
-        params[line[j]] = line[j+1]
+with profiler.stage('config load'):
+    try:
+        (config, row_errors) = load_tsv_records(
+            config_file,
+            cache_file=get_config_cache_path(config_file),
+            required_headers=CONFIG_HEADERS
+        )
+    except ValueError as e:
+        forms.alert(title='Configuration error', msg=str(e))
+        sys.exit()
 
-    d['parameters'] = params
-    config.append(d)
+    if config:
+        script_config.config_file = config_file
+        script.save_config()
 
-if config:
-    script_config.config_file = config_file
-    script.save_config()
+    family_types = get_family_types()
+    mappings, config_errors = compile_config(config, doc)
+    config_errors = [
+        ('Line {}'.format(line_number), error)
+        for (line_number, error) in row_errors
+    ] + config_errors
+if config_errors:
+    proceed = forms.alert(
+        title='Configuration errors',
+        msg=(
+            'Found {} configuration errors. '
+            'Continue with the remaining blocks?'
+        ).format(len(config_errors)),
+        sub_msg='\n'.join([
+            '{} : {}'.format(block_name, error)
+            for (block_name, error) in config_errors
+        ]),
+        ok=False,
+        yes=True,
+        no=True
+    )
+    if not proceed:
+        sys.exit()
 
-family_types = get_family_types()
 reference_planes = get_reference_planes()
 cad_imports = get_cad_imports()
 if not cad_imports:
@@ -90,25 +313,37 @@ if not cad_imports:
     )
     sys.exit()
 
-# Select DWG import if more than one
+# Select DWG imports if more than one. Several imports are mapped in one
+# batch, sharing the host indexes and configuration.
 if len(cad_imports) > 1:
-    cad_import = forms.SelectFromList.show(
-        title='Select CAD Import to Map to Revit',
+    selected_imports = forms.SelectFromList.show(
+        title='Select CAD Imports to Map to Revit',
         context=cad_imports,
-        name_attr='name'
+        name_attr='name',
+        multiselect=True
     )
 else:
-    cad_import = cad_imports[0]
+    selected_imports = cad_imports
 
-if not cad_import:
+if not selected_imports:
     sys.exit()
 else:
-    cad_import = cad_import._import   # we no longer care about name
+    # we no longer care about name
+    selected_imports = [cad_import._import for cad_import in selected_imports]
 
-# Gather import geometry
-import_transform = cad_import.GetTotalTransform()
-blocks = get_blocks(cad_import)
-blocks_grouped_by_name = group_blocks_by_name(blocks)
+# Gather import geometry. Blocks are grouped by name across imports and
+# carry the transform of their import.
+blocks_grouped_by_name = {}
+for cad_import in selected_imports:
+    import_transform = cad_import.GetTotalTransform()
+    with profiler.stage('block gathering'):
+        blocks = get_blocks(cad_import) or []
+    with profiler.stage('grouping', count=len(blocks)):
+        groups = group_blocks_by_name(blocks) or {}
+        for block_name, group in groups.items():
+            blocks_grouped_by_name.setdefault(block_name, []).extend(
+                (import_transform, block) for block in group
+            )
 
 # Filter blocks by user selection
 selected_blocks = forms.SelectFromList.show(
@@ -118,6 +353,11 @@ selected_blocks = forms.SelectFromList.show(
 )
 if not selected_blocks:
     sys.exit()
+deselected_blocks = set(blocks_grouped_by_name) - set(selected_blocks)
+blocks_in_drawing = dict(
+    (block_name, [block for (_, block) in items])
+    for block_name, items in blocks_grouped_by_name.items()
+)
 blocks_grouped_by_name = dict([
     (block_name, group) for block_name, group in blocks_grouped_by_name.items()
     if block_name in selected_blocks
@@ -128,47 +368,234 @@ start_time = time.time()
 cnt = 0
 total = sum(map(len, blocks_grouped_by_name.values()))
 no_mapping = {}
-failed = []
-with forms.ProgressBar(
-    title='{value} of {max_value}',
-    step=20,
-    cancellable=True
-) as pb:
-    with rpw.db.Transaction('CAD -> Revit', doc=doc) as t:
-        for block_name, blocks in blocks_grouped_by_name.items():
+skipped = 0
+moved_or_deleted = []
+
+
+def locate_blocks(items, origin_offset):
+    block_locations = []
+    for import_transform, _items in groupby(
+        items,
+        key=lambda item: item[2][0]
+    ):
+        block_locations.extend(get_block_locations(
+            blocks=[block for (_, _, (_, block)) in _items],
+            transform=import_transform,
+            origin_offset=origin_offset
+        ))
+
+    return block_locations
+
+
+def get_block_level(location):
+    if level_by_elevation:
+        return find_level_below(location.Z)
+    else:
+        return level
+
+
+def plan_blocks(block_name, items):
+    mapping = mappings[block_name]
+    block_locations = locate_blocks(items, mapping['origin_offset'])
+
+    placements = []
+    for (
+        (_, i, (import_transform, block)),
+        block_location
+    ) in zip(items, block_locations):
+        block_level = get_block_level(block_location[0])
+        try:
+            placements.append(plan_block(
+                family_type=mapping['family_type'],
+                host=mapping['host'],
+                backup_host=mapping['backup_host'],
+                origin_offset=mapping['origin_offset'],
+                orientation_offset=mapping['orientation_offset'],
+                parameters=mapping['parameters'],
+                block=block,
+                transform=import_transform,
+                doc=doc,
+                level=block_level,
+                block_name=block_name,
+                index=i,
+                block_location=block_location
+            ))
+        except (AttributeError, TypeError) as e:
+            failed.append((block_name, i, str(e)))
+            profiler.fail(block_name, str(e))
+
+    return placements
+
+
+if mode == EXPORT_PLAN:
+    placements = []
+    with forms.ProgressBar(
+        title='Planning {value} of {max_value}',
+        step=20,
+        cancellable=True
+    ) as pb:
+        for block_name, blocks in sorted(blocks_grouped_by_name.items()):
             if pb.cancelled:
-                break
+                sys.exit()
 
-            if not config:
+            if block_name not in mappings:
                 no_mapping[block_name] = blocks
-                cnt += len(blocks)
-                pb.update_progress(cnt, total)
-                continue
+            else:
+                placements.extend(plan_blocks(
+                    block_name,
+                    [(block_name, i, item) for i, item in enumerate(blocks)]
+                ))
 
-            try:
-                mapping = parse_config(block_name, config, doc)
-            except ValueError:
-                no_mapping[block_name] = blocks
-                cnt += len(blocks)
-                pb.update_progress(cnt, total)
+            cnt += len(blocks)
+            pb.update_progress(cnt, total)
+
+    plan_file = forms.save_file(
+        file_ext='json',
+        default_name=os.path.splitext(os.path.basename(config_file))[0],
+        restore_dir=True
+    )
+    if not plan_file:
+        sys.exit()
+
+    write_plan(plan_file, placements, doc)
+    commit_times = []
+    resumed = 0
+else:
+    # Resume from the last committed chunk of an interrupted run. A re-sync
+    # skips every block that is already placed, so it starts afresh and
+    # keeps no checkpoint that a later run could resume.
+    if mode == RESYNC:
+        checkpoint = Checkpoint(path=None, key=None)
+    else:
+        checkpoint = Checkpoint.load(
+            path=get_checkpoint_path(config_file),
+            key=get_checkpoint_key(
+                doc,
+                selected_imports,
+                config_file,
+                block_groups=blocks_in_drawing
+            )
+        )
+        resume(checkpoint)
+
+    pending = []
+    for block_name, blocks in sorted(blocks_grouped_by_name.items()):
+        if block_name not in mappings:
+            no_mapping[block_name] = blocks
+            cnt += len(blocks)
+            continue
+
+        for i, item in enumerate(blocks):
+            if checkpoint.is_done(block_name, i):
+                cnt += 1
             else:
-                for block in blocks:
-                    map_block_to_family_instance(
-                        family_type=mapping['family_type'],
-                        host=mapping['host'],
-                        backup_host=mapping['backup_host'],
-                        origin_offset=mapping['origin_offset'],
-                        orientation_offset=mapping['orientation_offset'],
-                        parameters=mapping['parameters'],
-                        block=block,
-                        transform=import_transform,
-                        doc=doc,
-                        view=view,
-                        level=level,
-                    )
-                    cnt += 1
-                    pb.update_progress(cnt, total)
+                pending.append((block_name, i, item))
+    resumed = cnt - sum(len(blocks) for blocks in no_mapping.values())
+
+    if mode == RESYNC:
+        resync_tolerance = float(getattr(
+            script_config,
+            'resync_tolerance',
+            DEFAULT_RESYNC_TOLERANCE
+        ))
+        # Mapped family types are hashed on every level, so instances whose
+        # block was deleted or renamed are reported too. Blocks left out of
+        # this run are not.
+        family_type_ids = dict(
+            (m['family_type'].Id.IntegerValue, m['family_type'].Id)
+            for (block_name, m) in mappings.items()
+            if block_name not in deselected_blocks
+        )
+
+        # Placed instances lie within the selected imports, give or take
+        # the match tolerance
+        max_tolerance = resync_tolerance + max([0.0] + [
+            (host or {}).get('tolerance', 0.0)
+            for m in mappings.values()
+            for host in (m['host'], m['backup_host'])
+        ])
+        extents = None
+        for cad_import in selected_imports:
+            box = cad_import.get_BoundingBox(None)
+            if box is None:
+                extents = None
+                break
+            elif extents is None:
+                extents = (box.Min.X, box.Min.Y, box.Max.X, box.Max.Y)
+            else:
+                extents = (
+                    min(extents[0], box.Min.X),
+                    min(extents[1], box.Min.Y),
+                    max(extents[2], box.Max.X),
+                    max(extents[3], box.Max.Y)
+                )
+        if extents:
+            extents = (
+                extents[0] - max_tolerance,
+                extents[1] - max_tolerance,
+                extents[2] + max_tolerance,
+                extents[3] + max_tolerance
+            )
+
+        instance_hash = hash_family_instances(
+            family_type_ids.values(),
+            tolerance=resync_tolerance,
+            doc=doc,
+            extents=extents
+        )
+
+        # Blocks are matched to instances on their own level
+        located = []
+        for block_name, items in groupby(pending, key=itemgetter(0)):
+            items = list(items)
+            mapping = mappings[block_name]
+
+            # Wall hosted instances sit on the wall face, not the block
+            tolerance = resync_tolerance + max(
+                (host or {}).get('tolerance', 0.0)
+                for host in (mapping['host'], mapping['backup_host'])
+            )
+            block_locations = locate_blocks(items, mapping['origin_offset'])
+            for item, (location, _) in zip(items, block_locations):
+                block_level = get_block_level(location)
+                level_id = block_level.Id.IntegerValue if block_level else None
+                located.append((item, mapping, tolerance, level_id, location))
+
+        changed = []
+        for item, mapping, tolerance, level_id, location in located:
+            element_id = instance_hash.pop_match(
+                mapping['family_type'].Id.IntegerValue,
+                level_id,
+                location.X,
+                location.Y,
+                tolerance=tolerance
+            )
+            if element_id is None:
+                changed.append(item)
 
+        skipped = len(pending) - len(changed)
+        pending = changed
+        cnt += skipped
+        moved_or_deleted = instance_hash.remaining()
+
+    (cnt, commit_times) = place_in_chunks(
+        pending,
+        get_placements=plan_blocks,
+        checkpoint=checkpoint,
+        cnt=cnt,
+        total=total
+    )
+
+
+profiler.write(
+    get_profile_path(config_file),
+    document=doc.Title,
+    revit=doc.Application.VersionNumber,
+    mode=mode,
+    imports=len(selected_imports),
+    blocks=total,
+    seconds=time.time()-start_time
+)
 
 no_mapping_count = sum(len(blocks) for blocks in no_mapping.values())
 config_warning = (
@@ -179,15 +606,52 @@ config_warning = (
     ]) +
     '\n\n'
 )
+chunk_summary = (
+    'Committed {} chunks:\n'.format(len(commit_times)) +
+    '\n'.join([
+        '{0} : {1:.2f} seconds'.format(n+1, commit_time)
+        for (n, commit_time) in enumerate(commit_times)
+    ]) +
+    '\n\n'
+)
 results = (
-    'Processed {0} elements in {1:4} seconds.\n'
-    .format(cnt, time.time()-start_time) +
-    'Successfully placed {} elements.\n'
-    .format(cnt-no_mapping_count-len(failed)) +
+    ('Resumed after {} previously placed elements.\n'.format(resumed)
+     if resumed else '') +
+    'Processed {0} elements from {1} CAD imports in {2:4} seconds.\n'
+    .format(cnt, len(selected_imports), time.time()-start_time) +
+    ('Planned {} elements.\n'.format(len(placements))
+     if mode == EXPORT_PLAN else
+     'Successfully placed {} elements.\n'
+     .format(cnt-resumed-no_mapping_count-len(failed)-skipped)) +
     'Failed to place {} elements.'.format(len(failed))
 )
+if mode == RESYNC:
+    results += (
+        '\nSkipped {} blocks that were already placed.\n'.format(skipped) +
+        '{} placed elements within the selected CAD imports no longer '
+        'match a block (moved or deleted) and were left selected.'
+        .format(len(moved_or_deleted))
+    )
+
+    selection = rpw.ui.Selection(uidoc=uidoc)
+    selection.clear()
+    selection.add(moved_or_deleted)
+    selection.update()
+
+failures = {}
+for (block_name, _, reason) in failed:
+    failures[(block_name, reason)] = failures.get((block_name, reason), 0) + 1
 forms.alert(
     title='Results',
-    msg='{}{}'.format(config_warning if no_mapping_count else '', results),
+    msg='{}{}{}'.format(
+        config_warning if no_mapping_count else '',
+        chunk_summary if len(commit_times) > 1 else '',
+        results
+    ),
+    sub_msg='\n'.join(
+        ['{} : {} ({} blocks)'.format(block_name, reason, count)
+         for ((block_name, reason), count) in sorted(failures.items())] +
+        ['Timings logged to {}'.format(get_profile_path(config_file))]
+    ),
     warn_icon=False
 )
@@ -0,0 +1,56 @@
+# Batched transform math on plain tuples. No Revit API is used here, so a
+# whole block group is resolved with two .NET property reads per block.
+import math
+
+
+# 3x4 row-major matrix: rotation/scale columns followed by the origin
+def to_matrix(transform):
+    bx, by, bz = transform.BasisX, transform.BasisY, transform.BasisZ
+    o = transform.Origin
+    return (
+        (bx.X, by.X, bz.X, o.X),
+        (bx.Y, by.Y, bz.Y, o.Y),
+        (bx.Z, by.Z, bz.Z, o.Z)
+    )
+
+
+# BasisX column and origin of a block transform, the only parts of it that
+# block_locations reads
+def to_block_matrix(transform):
+    bx, o = transform.BasisX, transform.Origin
+    return (
+        (bx.X, o.X),
+        (bx.Y, o.Y),
+        (bx.Z, o.Z)
+    )
+
+
+# World location and orientation of each block from to_block_matrix,
+# matching transform.Multiply(block.Transform), XYZ.BasisX.AngleTo(direction)
+# and the origin offset rotated by that angle about Z
+def block_locations(import_matrix, block_matrices, origin_offset):
+    (ox, oy, oz) = origin_offset
+    (r0, r1, r2) = import_matrix
+
+    locations = []
+    for (b0, b1, b2) in block_matrices:
+        # Only the BasisX column and origin of the product are needed
+        dx = r0[0]*b0[0] + r0[1]*b1[0] + r0[2]*b2[0]
+        dy = r1[0]*b0[0] + r1[1]*b1[0] + r1[2]*b2[0]
+        dz = r2[0]*b0[0] + r2[1]*b1[0] + r2[2]*b2[0]
+        x = r0[0]*b0[1] + r0[1]*b1[1] + r0[2]*b2[1] + r0[3]
+        y = r1[0]*b0[1] + r1[1]*b1[1] + r1[2]*b2[1] + r1[3]
+        z = r2[0]*b0[1] + r2[1]*b1[1] + r2[2]*b2[1] + r2[3]
+
+        # Unsigned angle between BasisX and the block direction
+        orientation = math.atan2(math.hypot(dy, dz), dx)
+        cos, sin = math.cos(orientation), math.sin(orientation)
+
+        locations.append((
+            x - (ox*cos - oy*sin),
+            y - (ox*sin + oy*cos),
+            z - oz,
+            orientation
+        ))
+
+    return locations
@@ -5,8 +5,9 @@ from Autodesk.Revit.DB import StorageType
 
 from pyrevit import forms
 import rpw
+from boostutils import TypeParameterCache
 
-from common import get_element_meta, Filter, FilterForm
+from common import ElementStore, get_element_meta, Filter, FilterForm
 
 __doc__ = '''\
 Filter based on selected criteria.
@@ -15,75 +16,90 @@ __author__ = 'Zachary Mathews'
 __context__ = 'Selection'
 
 
-def _get_element_dict(e, meta):
-    element = {}
-    for p in e.Parameters:
-        if p.StorageType == StorageType.String:
-            if p.HasValue:
-                _str = p.AsString()
-                _value_str = p.AsValueString()
-                element[p.Definition.Name] = (
-                    _str if _str is not None else _value_str
-                )
-            else:
-                element[p.Definition.Name] = 'None'
-
-        elif p.StorageType == StorageType.Integer:
-            if p.HasValue:
-                if int(__revit__.Application.VersionNumber) < 2022:
-                    from Autodesk.Revit.DB import ParameterType
-
-                    if p.Definition.ParameterType == ParameterType.YesNo:
-                        element[p.Definition.Name] = (
-                            'Yes' if p.AsInteger() == 1 else 'No'
-                        )
-                    else:
-                        element[p.Definition.Name] = p.AsValueString()
-                else:
-                    from Autodesk.Revit.DB import SpecTypeId
-
-                    if p.GetTypeId() == SpecTypeId.Boolean.YesNo:
-                        element[p.Definition.Name] = (
-                            'Yes' if p.AsInteger() == 1 else 'No'
-                        )
-                    else:
-                        element[p.Definition.Name] = p.AsValueString()
-            else:
-                element[p.Definition.Name] = 'None'
-
-        elif p.StorageType == StorageType.Double:
-            if p.HasValue:
-                element[p.Definition.Name] = p.AsValueString()
-            else:
-                element[p.Definition.Name] = 'None'
-
-    element.update(meta)
-    return element
+def _is_filterable(p):
+    return p.StorageType in (
+        StorageType.String,
+        StorageType.Integer,
+        StorageType.Double
+    )
 
 
-def _get_filterable_parameters(elements):
+# Elements of one family type and category share their parameter names, so
+# the names are read from one element of each
+def _get_filterable_parameters(elements, get_element_meta):
     parameters = set()
+    seen = set()
     for e in elements:
-        parameters.update(e.keys())
+        key = (
+            e.Category.Id.IntegerValue if e.Category else None,
+            e.GetTypeId().IntegerValue
+        )
+        if key in seen:
+            continue
+        seen.add(key)
+
+        parameters.update(
+            p.Definition.Name for p in e.Parameters if _is_filterable(p)
+        )
+        parameters.update(get_element_meta(e).keys())
 
     return parameters
 
 
+# Yes/No parameters are shown as Yes or No. The check depends on the Revit
+# version, so it is resolved once here.
+def _get_yes_no_check():
+    if int(__revit__.Application.VersionNumber) < 2022:
+        from Autodesk.Revit.DB import ParameterType
+
+        return lambda p: p.Definition.ParameterType == ParameterType.YesNo
+    else:
+        from Autodesk.Revit.DB import SpecTypeId
+
+        yes_no = SpecTypeId.Boolean.YesNo
+        return lambda p: p.GetTypeId() == yes_no
+
+
+def _get_parameter_value(p, is_yes_no):
+    if not p.HasValue:
+        return 'None'
+
+    if p.StorageType == StorageType.String:
+        _str = p.AsString()
+        return _str if _str is not None else p.AsValueString()
+    elif p.StorageType == StorageType.Integer:
+        if is_yes_no(p):
+            return 'Yes' if p.AsInteger() == 1 else 'No'
+        else:
+            return p.AsValueString()
+    elif p.StorageType == StorageType.Double:
+        return p.AsValueString()
+
+
+# Only the chosen criteria are read
+def _get_element_dict(e, meta, criteria, is_yes_no):
+    element = {}
+    for name in criteria:
+        p = e.LookupParameter(name)
+        if p is not None and _is_filterable(p):
+            element[name] = _get_parameter_value(p, is_yes_no)
+
+    element.update(meta)
+    return element
+
+
 if __name__ == '__main__':
     uidoc = rpw.revit.uidoc
     doc = rpw.revit.doc
     selection = rpw.ui.Selection(uidoc=uidoc)
     _get_element_meta = partial(
         get_element_meta,
-        workset_table=doc.GetWorksetTable()
+        workset_table=doc.GetWorksetTable(),
+        cache=TypeParameterCache(doc)
     )
 
-    elements = [
-        _get_element_dict(e, meta=_get_element_meta(e))
-        for e in selection.get_elements(wrapped=False)
-    ]
-
-    parameters = _get_filterable_parameters(elements)
+    revit_elements = selection.get_elements(wrapped=False)
+    parameters = _get_filterable_parameters(revit_elements, _get_element_meta)
     parameters = forms.SelectFromList.show(
         title='Select filter criteria',
         context=sorted(parameters),
@@ -94,6 +110,16 @@ if __name__ == '__main__':
         sys.exit()
 
     criteria = parameters
+    is_yes_no = _get_yes_no_check()
+    elements = ElementStore(criteria)
+    for e in revit_elements:
+        elements.append(e.Id, _get_element_dict(
+            e,
+            meta=_get_element_meta(e),
+            criteria=criteria,
+            is_yes_no=is_yes_no
+        ))
+
     if elements:
         _filter = Filter(criteria, elements)
 
@@ -106,5 +132,5 @@ if __name__ == '__main__':
 
         # Update selection
         selection.clear()
-        selection.add([e['ID'] for e in filtered_elements])
+        selection.add(filtered_elements)
         selection.update()
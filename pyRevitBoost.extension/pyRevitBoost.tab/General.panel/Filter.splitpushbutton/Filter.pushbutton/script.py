@@ -1,8 +1,13 @@
 # pylint: disable=import-error
 from functools import partial
+from System.Collections.Generic import List
+
+from Autodesk.Revit.DB import ElementId
+
 import rpw
+from boostutils import TypeParameterCache
 
-from common import get_element_meta, Filter, FilterForm
+from common import ElementStore, get_element_meta, Filter, FilterForm
 
 __doc__ = '''\
 Filter based on category, family, type and workset.
@@ -16,19 +21,20 @@ if __name__ == '__main__':
     selection = rpw.ui.Selection(uidoc=uidoc)
     _get_element_meta = partial(
         get_element_meta,
-        workset_table=doc.GetWorksetTable()
+        workset_table=doc.GetWorksetTable(),
+        cache=TypeParameterCache(doc)
     )
 
-    elements = [
-        _get_element_meta(e)
-        for e in selection.get_elements(wrapped=False)
-        if _get_element_meta(e)
-    ]
-
     criteria = [
         'Category', 'Family', 'Type', 'Workset', 'Phase Created',
         'Phase Demolished'
     ]
+    elements = ElementStore(criteria)
+    for e in selection.get_elements(wrapped=False):
+        meta = _get_element_meta(e)
+        if meta:
+            elements.append(e.Id, meta)
+
     if elements:
         _filter = Filter(criteria, elements)
 
@@ -40,6 +46,4 @@ if __name__ == '__main__':
         ).show_dialog()
 
         # Update selection
-        selection.clear()
-        selection.add([e['ID'] for e in filtered_elements])
-        selection.update()
+        uidoc.Selection.SetElementIds(List[ElementId](filtered_elements))
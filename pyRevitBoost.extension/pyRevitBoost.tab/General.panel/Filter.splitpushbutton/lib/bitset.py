@@ -0,0 +1,25 @@
+# Sets of element rows stored in Python ints. No Revit API is used here.
+import binascii
+
+
+def to_bitset(rows):
+    if not rows:
+        return 0
+
+    # Built from bytes, since setting bits one at a time on a long is
+    # quadratic
+    data = bytearray(max(rows) // 8 + 1)
+    for row in rows:
+        data[row >> 3] |= 1 << (row & 7)
+    data.reverse()
+    return int(binascii.hexlify(data), 16)
+
+
+def iter_bitset(bitset):
+    for row, bit in enumerate(reversed(bin(bitset)[2:])):
+        if bit == '1':
+            yield row
+
+
+def popcount(bitset):
+    return bin(bitset).count('1')
@@ -1,31 +1,26 @@
-from System.ComponentModel import (INotifyPropertyChanged,
-                                   PropertyChangedEventArgs)
-from Autodesk.Revit.DB import BuiltInParameter
+from array import array
+
+from Autodesk.Revit.DB import BuiltInParameter, ElementId
 from pyrevit import forms
 
+from boostutils import (NotifyPropertyChangedBase, ObservableList,
+                        TypeParameterCache, suspended_notifications)
+
+from bitset import iter_bitset, popcount, to_bitset
+
 
-class Option(INotifyPropertyChanged):
+class Option(NotifyPropertyChangedBase):
     def __init__(
         self, value, _filter, criterion,
-        checked=False, available=True
+        checked=False, available=True, quantity=0
     ):
+        NotifyPropertyChangedBase.__init__(self)
         self._value = value
         self._filter = _filter
         self._criterion = criterion
         self._checked = checked
         self._available = available
-        self._property_changed_handlers = []
-
-    def _raise_property_changed(self, property_name):
-        args = PropertyChangedEventArgs(property_name)
-        for handler in self._property_changed_handlers:
-            handler(self, args)
-
-    def add_PropertyChanged(self, handler):
-        self._property_changed_handlers.append(handler)
-
-    def remove_PropertyChanged(self, handler):
-        self._property_changed_handlers.remove(handler)
+        self._quantity = quantity
 
     @property
     def value(self):
@@ -34,13 +29,16 @@ class Option(INotifyPropertyChanged):
     @value.setter
     def value(self, value):
         self._value = value
-        self._raise_property_changed('value')
+        self.OnPropertyChanged('value')
 
     @property
     def quantity(self):
-        return len(
-            self._filter.passes(criterion=self._criterion, value=self._value)
-        )
+        return self._quantity
+
+    @quantity.setter
+    def quantity(self, quantity):
+        self._quantity = quantity
+        self.OnPropertyChanged('quantity')
 
     @property
     def checked(self):
@@ -48,8 +46,11 @@ class Option(INotifyPropertyChanged):
 
     @checked.setter
     def checked(self, checked):
+        changed = checked != self._checked
         self._checked = checked
-        self._raise_property_changed('checked')
+        self.OnPropertyChanged('checked')
+        if changed:
+            self._filter.on_checked(self)
 
     @property
     def available(self):
@@ -58,77 +59,187 @@ class Option(INotifyPropertyChanged):
     @available.setter
     def available(self, available):
         self._available = available
-        self._raise_property_changed('available')
+        self.OnPropertyChanged('available')
 
 
 class Criterion(object):
     def __init__(self, name, options):
         self.name = name
-        self.options = options
+        self.options = ObservableList(options)
+
+    # Bulk changes reset the option list once instead of notifying per
+    # option
+    def bulk_update(self):
+        return suspended_notifications(
+            self.options,
+            on_resume=self.options.reset
+        )
 
     def check_all(self):
-        for o in self.options:
-            if o.available:
-                o.checked = True
+        with self.bulk_update():
+            for o in self.options:
+                if o.available:
+                    o.checked = True
 
     def uncheck_all(self):
-        for o in self.options:
-            if o.available:
-                o.checked = False
+        with self.bulk_update():
+            for o in self.options:
+                if o.available:
+                    o.checked = False
 
     def clear(self):
-        for option in self.options:
-            option.checked = False
-
-    def passes(self, element):
-        is_checked = any([
-            o.checked for o in self.options
-            if o.value == element.get(self.name, 'None')
-        ])
-        none_checked = not any(o.checked for o in self.options)
-        return is_checked or none_checked
-
-
+        with self.bulk_update():
+            for option in self.options:
+                option.checked = False
+
+
+# Elements stored by column. Each criterion column holds integer codes into
+# a table of its distinct values, and element ids sit in one array, so
+# elements sharing a value share one string.
+class ElementStore(object):
+    def __init__(self, criteria):
+        self.criteria = list(criteria)
+        self._ids = array('i')
+        self._columns = dict((c, array('i')) for c in self.criteria)
+        self._values = dict((c, []) for c in self.criteria)
+        self._codes = dict((c, {}) for c in self.criteria)
+
+    @classmethod
+    def from_dicts(cls, criteria, elements):
+        store = cls(criteria)
+        for e in elements:
+            store.append(e['ID'], e)
+        return store
+
+    def __len__(self):
+        return len(self._ids)
+
+    def append(self, element_id, values):
+        self._ids.append(element_id.IntegerValue)
+        for c in self.criteria:
+            self._columns[c].append(self.intern(c, values.get(c, 'None')))
+
+    def intern(self, criterion, value):
+        codes = self._codes[criterion]
+        if value not in codes:
+            codes[value] = len(self._values[criterion])
+            self._values[criterion].append(value)
+        return codes[value]
+
+    def code(self, criterion, value):
+        return self._codes[criterion].get(value)
+
+    def column(self, criterion):
+        return self._columns[criterion]
+
+    def values(self, criterion):
+        return self._values[criterion]
+
+    def element_id(self, row):
+        return ElementId(self._ids[row])
+
+
+# Inverted index from (criterion, value) to the set of element rows with
+# that value. Sets are bitsets stored in Python ints, so filtering is
+# intersection and counting is popcount.
+class FacetIndex(object):
+    def __init__(self, store):
+        self.size = len(store)
+        self.all = (1 << self.size) - 1
+        self._store = store
+
+        self._bitsets = {}
+        for criterion in store.criteria:
+            rows = [[] for _ in store.values(criterion)]
+            for row, code in enumerate(store.column(criterion)):
+                rows[code].append(row)
+
+            self._bitsets[criterion] = [to_bitset(_rows) for _rows in rows]
+
+    def values(self, criterion):
+        return sorted(self._store.values(criterion))
+
+    def bitset(self, criterion, value):
+        code = self._store.code(criterion, value)
+        return 0 if code is None else self._bitsets[criterion][code]
+
+
+# Facet counts are kept with the options. Checking an option only updates
+# the checked set of its criterion, and applying only recounts when the
+# filtered set has changed.
 class Filter(object):
     def __init__(self, criteria, elements):
+        if not isinstance(elements, ElementStore):
+            elements = ElementStore.from_dicts(criteria, elements)
+
         self._elements = elements
-        self._filtered = elements
+        self._index = FacetIndex(elements)
+        self._filtered = self._index.all
 
         self._criteria = []
         for c in criteria:
-            option_values = sorted(set(e.get(c, 'None') for e in elements))
             self._criteria.append(Criterion(
                 name=c,
                 options=[
-                    Option(v, _filter=self, criterion=c)
-                    for v in option_values
+                    Option(
+                        v, _filter=self, criterion=c,
+                        quantity=popcount(self._index.bitset(c, v))
+                    )
+                    for v in self._index.values(c)
                 ]
             ))
 
+        # Union of the checked options of each criterion, None when nothing
+        # is checked
+        self._checked = dict((c, None) for c in criteria)
+        self._counted = self._filtered
+
+        # Options by value code, for updating counts row by row
+        self._options = dict(
+            (
+                c.name,
+                dict((elements.code(c.name, o.value), o) for o in c.options)
+            )
+            for c in self._criteria
+        )
+        self._dirty = False
+
     @property
     def criteria(self):
         return self._criteria
 
+    # Element ids of the filtered elements
     @property
     def results(self):
-        return self._filtered
-
-    def passes(self, criterion, value):
         return [
-            e for e in self._filtered
-            if e.get(criterion, 'None') == value
+            self._elements.element_id(row)
+            for row in iter_bitset(self._filtered)
         ]
 
+    def on_checked(self, option):
+        name = option._criterion
+        bitset = self._index.bitset(name, option.value)
+        if option.checked:
+            self._checked[name] = (self._checked[name] or 0) | bitset
+        else:
+            # Values of one criterion have disjoint bitsets
+            union = (self._checked[name] or 0) & ~bitset
+            self._checked[name] = union or None
+
+        self._dirty = True
+
     def apply(self):
-        filtered = []
-        for el in self._elements:
-            for criterion in self._criteria:
-                if not criterion.passes(el):
-                    break
-            else:
-                filtered.append(el)
+        if not self._dirty:
+            return
+
+        filtered = self._index.all
+        for union in self._checked.values():
+            # Criteria with nothing checked pass every element
+            if union is not None:
+                filtered &= union
 
         self._filtered = filtered
+        self._dirty = False
         self._recompute_availability()
 
     def check_all(self, criterion):
@@ -146,20 +257,44 @@ class Filter(object):
         for criterion in self._criteria:
             criterion.clear()
 
-        self._filtered = self._elements
+        self._filtered = self._index.all
+        self._dirty = False
         self._recompute_availability()
 
+    # Only the counts of values held by elements that entered or left the
+    # filtered set change
     def _recompute_availability(self):
+        if self._filtered == self._counted:
+            return
+        added = list(iter_bitset(self._filtered & ~self._counted))
+        removed = list(iter_bitset(self._counted & ~self._filtered))
+        self._counted = self._filtered
+
         for criterion in self._criteria:
-            for option in criterion.options:
-                if not any(
-                    e.get(criterion.name, 'None') == option.value
-                    for e in self._filtered
-                ):
-                    option.checked = False
-                    option.available = False
-                else:
-                    option.available = True
+            column = self._elements.column(criterion.name)
+            deltas = {}
+            for row in added:
+                deltas[column[row]] = deltas.get(column[row], 0) + 1
+            for row in removed:
+                deltas[column[row]] = deltas.get(column[row], 0) - 1
+
+            changed = [
+                (code, delta) for (code, delta) in deltas.items() if delta
+            ]
+            if not changed:
+                continue
+
+            options = self._options[criterion.name]
+            with criterion.bulk_update():
+                for code, delta in changed:
+                    option = options[code]
+                    option.quantity += delta
+                    if not option.quantity:
+                        option.checked = False
+                        if option.available:
+                            option.available = False
+                    elif not option.available:
+                        option.available = True
 
 
 class FilterFormTab(object):
@@ -226,17 +361,19 @@ class FilterForm(forms.WPFWindow):
         return self._filter.results
 
 
-def get_element_meta(e, workset_table):
+# Family, type, workset and phase names are shared by many elements, so
+# they are read through a TypeParameterCache
+def get_element_meta(e, workset_table, cache=None):
+    if cache is None:
+        cache = TypeParameterCache(e.Document)
+
     category = e.Category
-    family = e.get_Parameter(BuiltInParameter.ELEM_FAMILY_PARAM)
-    _type = e.get_Parameter(BuiltInParameter.ELEM_TYPE_PARAM)
+    family = cache.get_type_value_string(e, builtin='ELEM_FAMILY_PARAM')
+    _type = cache.get_type_value_string(e, builtin='ELEM_TYPE_PARAM')
     workset_id = e.WorksetId
     phase_created = e.get_Parameter(BuiltInParameter.PHASE_CREATED)
     phase_demolished = e.get_Parameter(BuiltInParameter.PHASE_DEMOLISHED)
 
-    phase_created = 'None' if phase_created is None else phase_created
-    phase_demolished = 'None' if phase_demolished is None else phase_demolished
-
     if (
         category is None
         or family is None
@@ -248,9 +385,15 @@ def get_element_meta(e, workset_table):
         return {
             'ID': e.Id,
             'Category': category.Name,
-            'Family': family.AsValueString(),
-            'Type': _type.AsValueString(),
-            'Workset': workset_table.GetWorkset(workset_id).Name,
-            'Phase Created': phase_created.AsValueString(),
-            'Phase Demolished': phase_demolished.AsValueString(),
-        }
\ No newline at end of file
+            'Family': family,
+            'Type': _type,
+            'Workset': cache.get_workset_name(workset_id),
+            'Phase Created': (
+                'None' if phase_created is None
+                else cache.get_element_id_value_string(phase_created)
+            ),
+            'Phase Demolished': (
+                'None' if phase_demolished is None
+                else cache.get_element_id_value_string(phase_demolished)
+            ),
+        }
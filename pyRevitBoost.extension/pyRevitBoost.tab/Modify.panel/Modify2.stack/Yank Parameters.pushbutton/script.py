@@ -9,7 +9,7 @@ from Autodesk.Revit.Exceptions import InvalidOperationException
 
 import rpw
 from pyrevit import script, forms
-from boostutils import get_parameter, load_as_python
+from boostutils import TypeParameterCache, get_parameter, load_as_python
 
 __doc__ = '''\
 Yank parameters from nearest in linked models.
@@ -21,6 +21,16 @@ __author__ = 'Zachary Mathews'
 __context__ = 'Selection'
 
 
+# Type parameters of the active and linked documents, read once per type
+type_parameter_caches = {}
+
+
+def get_type_parameter_cache(doc):
+    if doc not in type_parameter_caches:
+        type_parameter_caches[doc] = TypeParameterCache(doc)
+    return type_parameter_caches[doc]
+
+
 def get_link_instance(title):
     return rpw.db.Collector(
         of_category='OST_RvtLinks',
@@ -37,16 +47,19 @@ def doc_title_filter(link, title):
 
 def family_filter(el, family):
     return (
-        get_parameter(
+        get_type_parameter_cache(el.Document).get_type_value_string(
             el,
             builtin='ELEM_FAMILY_PARAM'
-        ).AsValueString() == family
+        ) == family
     )
 
 
 def type_filter(el, type):
     return (
-        get_parameter(el, builtin='ELEM_TYPE_PARAM').AsValueString() == type
+        get_type_parameter_cache(el.Document).get_type_value_string(
+            el,
+            builtin='ELEM_TYPE_PARAM'
+        ) == type
     )
 
 
@@ -58,10 +71,11 @@ def phase_filter(el, phase, current_phase, phase_map=None):
                 builtin='PHASE_CREATED'
             ).AsElementId() == phase_map[current_phase]
         else:
-            return get_parameter(
-                el,
-                builtin='PHASE_CREATED'
-            ).AsValueString() == phase
+            return get_type_parameter_cache(
+                el.Document
+            ).get_element_id_value_string(
+                get_parameter(el, builtin='PHASE_CREATED')
+            ) == phase
 
     else:
         if phase == '<current>':
@@ -70,10 +84,11 @@ def phase_filter(el, phase, current_phase, phase_map=None):
                 builtin='PHASE_CREATED'
             ).AsElementId() == current_phase
         else:
-            return get_parameter(
-                el,
-                builtin='PHASE_CREATED'
-            ).AsValueString() == phase
+            return get_type_parameter_cache(
+                el.Document
+            ).get_element_id_value_string(
+                get_parameter(el, builtin='PHASE_CREATED')
+            ) == phase
 
 
 def parameter_filter(el, parameter):
@@ -87,7 +102,11 @@ def parameter_filter(el, parameter):
         'comparison_operator': match.group('comparison_operator'),
         'value': match.group('value')
     }
-    parameter = get_parameter(el, name=filter['name'])
+    parameter = get_parameter(
+        el,
+        name=filter['name'],
+        cache=get_type_parameter_cache(el.Document)
+    )
 
     if filter['comparison_operator'] == '=':
         value = parameter.AsString()
@@ -179,7 +198,11 @@ def yank(_pair, mapping):
         if is_separator:
             value += is_separator.group('separator')
         else:
-            parameter = get_parameter(_pair['from'], name=name)
+            parameter = get_parameter(
+                _pair['from'],
+                name=name,
+                cache=get_type_parameter_cache(_pair['from'].Document)
+            )
             _pval = parameter.AsString()
             value += _pval if _pval else ''
 
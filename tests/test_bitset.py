@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'pyRevitBoost.extension',
+    'pyRevitBoost.tab',
+    'General.panel',
+    'Filter.splitpushbutton',
+    'lib'
+))
+
+from bitset import iter_bitset, popcount, to_bitset  # noqa: E402
+
+
+def test_empty():
+    assert to_bitset([]) == 0
+    assert list(iter_bitset(0)) == []
+    assert popcount(0) == 0
+
+
+def test_to_bitset_sets_row_bits():
+    assert to_bitset([0]) == 1
+    assert to_bitset([0, 3]) == 0b1001
+    assert to_bitset([9, 8]) == (1 << 9) | (1 << 8)
+
+
+def test_round_trip():
+    rows = [0, 1, 7, 8, 63, 64, 1000]
+
+    assert list(iter_bitset(to_bitset(rows))) == rows
+    assert popcount(to_bitset(rows)) == len(rows)
+
+
+def test_duplicate_rows():
+    assert to_bitset([5, 5]) == 1 << 5
+
+
+def test_intersection_and_difference():
+    a = to_bitset([1, 2, 3])
+    b = to_bitset([2, 3, 4])
+
+    assert list(iter_bitset(a & b)) == [2, 3]
+    assert list(iter_bitset(a & ~b)) == [1]
+    assert popcount(a | b) == 4
@@ -0,0 +1,120 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'pyRevitBoost.extension',
+    'pyRevitBoost.tab',
+    'General.panel',
+    'CADToRevit.pushbutton'
+))
+
+from index import (ElevationIndex, GridIndex,  # noqa: E402
+                   closest_point_on_loops, distance_to_segment,
+                   point_in_polygon, suggest_cell_size)
+
+SQUARE = [(0.0, 0.0), (10.0, 0.0), (10.0, 10.0), (0.0, 10.0)]
+HOLE = [(4.0, 4.0), (6.0, 4.0), (6.0, 6.0), (4.0, 6.0)]
+
+
+def test_point_in_polygon():
+    assert point_in_polygon(5.0, 5.0, [SQUARE])
+    assert not point_in_polygon(15.0, 5.0, [SQUARE])
+    assert not point_in_polygon(-1.0, -1.0, [SQUARE])
+
+
+def test_point_in_hole_is_outside():
+    assert not point_in_polygon(5.0, 5.0, [SQUARE, HOLE])
+    assert point_in_polygon(2.0, 5.0, [SQUARE, HOLE])
+
+
+def test_point_in_concave_polygon():
+    notched = [
+        (0.0, 0.0), (10.0, 0.0), (10.0, 10.0),
+        (5.0, 5.0), (0.0, 10.0)
+    ]
+
+    assert point_in_polygon(5.0, 2.0, [notched])
+    assert not point_in_polygon(5.0, 8.0, [notched])
+
+
+def test_closest_point_on_loops():
+    assert closest_point_on_loops(15.0, 5.0, [SQUARE]) == \
+        pytest.approx((10.0, 5.0))
+    assert closest_point_on_loops(-3.0, -4.0, [SQUARE]) == \
+        pytest.approx((0.0, 0.0))
+
+
+def test_closest_point_on_loops_includes_holes():
+    assert closest_point_on_loops(5.0, 5.5, [SQUARE, HOLE]) == \
+        pytest.approx((5.0, 6.0))
+
+
+def test_closest_point_on_no_loops():
+    assert closest_point_on_loops(0.0, 0.0, []) is None
+
+
+def test_distance_to_segment():
+    assert distance_to_segment(5.0, 3.0, 0.0, 0.0, 10.0, 0.0) == \
+        pytest.approx(3.0)
+    assert distance_to_segment(13.0, 4.0, 0.0, 0.0, 10.0, 0.0) == \
+        pytest.approx(5.0)
+    assert distance_to_segment(3.0, 4.0, 0.0, 0.0, 0.0, 0.0) == \
+        pytest.approx(5.0)
+
+
+def test_grid_index_query_point():
+    index = GridIndex(cell_size=5.0)
+    index.insert('a', 0.0, 0.0, 4.0, 4.0)
+    index.insert('b', 3.0, 3.0, 12.0, 12.0)
+
+    assert len(index) == 2
+    assert index.query_point(1.0, 1.0) == ['a', 'b']
+    assert index.query_point(11.0, 11.0) == ['b']
+    assert index.query_point(-1.0, -1.0) == []
+
+
+def test_grid_index_query_radius_returns_each_item_once():
+    index = GridIndex(cell_size=1.0)
+    index.insert('wall', 0.0, 0.0, 10.0, 0.5)
+    index.insert('far', 50.0, 50.0, 51.0, 51.0)
+
+    assert index.query_radius(5.0, 0.0, 2.0) == ['wall']
+
+
+def test_grid_index_rejects_empty_cells():
+    with pytest.raises(ValueError):
+        GridIndex(cell_size=0)
+
+
+def test_elevation_index_below():
+    index = ElevationIndex([(10.0, 'L2'), (0.0, 'L1'), (20.0, 'L3')])
+
+    assert len(index) == 3
+    assert index.below(5.0) == 'L1'
+    assert index.below(10.0) == 'L2'
+    assert index.below(25.0) == 'L3'
+
+
+def test_elevation_index_tolerance():
+    index = ElevationIndex([(0.0, 'L1'), (10.0, 'L2')])
+
+    assert index.below(10.0 - 1e-9) == 'L2'
+
+
+def test_elevation_index_below_every_level_falls_back_to_lowest():
+    index = ElevationIndex([(10.0, 'L2'), (0.0, 'L1')])
+
+    assert index.below(-5.0) == 'L1'
+
+
+def test_elevation_index_empty():
+    assert ElevationIndex([]).below(0.0) is None
+
+
+def test_suggest_cell_size():
+    assert suggest_cell_size([]) == 1.0
+    assert suggest_cell_size([(0.0, 0.0, 4.0, 2.0)]) == pytest.approx(3.0)
+    assert suggest_cell_size([(0.0, 0.0, 0.1, 0.1)]) == 1.0
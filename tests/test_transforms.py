@@ -0,0 +1,118 @@
+import math
+import os
+import sys
+from collections import namedtuple
+
+import pytest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'pyRevitBoost.extension',
+    'pyRevitBoost.tab',
+    'General.panel',
+    'CADToRevit.pushbutton'
+))
+
+from transforms import (block_locations, to_block_matrix,  # noqa: E402
+                        to_matrix)
+
+XYZ = namedtuple('XYZ', ['X', 'Y', 'Z'])
+Transform = namedtuple('Transform', ['BasisX', 'BasisY', 'BasisZ', 'Origin'])
+
+
+def rotation(angle, origin=(0, 0, 0)):
+    cos, sin = math.cos(angle), math.sin(angle)
+    return Transform(
+        BasisX=XYZ(cos, sin, 0),
+        BasisY=XYZ(-sin, cos, 0),
+        BasisZ=XYZ(0, 0, 1),
+        Origin=XYZ(*origin)
+    )
+
+
+IDENTITY = to_matrix(rotation(0))
+
+
+def test_to_matrix_puts_basis_vectors_in_columns():
+    transform = Transform(
+        BasisX=XYZ(1, 2, 3),
+        BasisY=XYZ(4, 5, 6),
+        BasisZ=XYZ(7, 8, 9),
+        Origin=XYZ(10, 11, 12)
+    )
+
+    assert to_matrix(transform) == (
+        (1, 4, 7, 10),
+        (2, 5, 8, 11),
+        (3, 6, 9, 12)
+    )
+
+
+def test_to_block_matrix_keeps_basis_x_and_origin():
+    transform = Transform(
+        BasisX=XYZ(1, 2, 3),
+        BasisY=None,
+        BasisZ=None,
+        Origin=XYZ(10, 11, 12)
+    )
+
+    assert to_block_matrix(transform) == ((1, 10), (2, 11), (3, 12))
+
+
+def test_no_blocks():
+    assert block_locations(IDENTITY, [], (0, 0, 0)) == []
+
+
+def test_block_origin_and_rotation():
+    [(x, y, z, orientation)] = block_locations(
+        IDENTITY,
+        [to_block_matrix(rotation(math.pi / 2, origin=(10, 5, 2)))],
+        (0, 0, 0)
+    )
+
+    assert (x, y, z) == pytest.approx((10, 5, 2))
+    assert orientation == pytest.approx(math.pi / 2)
+
+
+def test_orientation_is_unsigned_like_angle_to():
+    [(_, _, _, orientation)] = block_locations(
+        IDENTITY,
+        [to_block_matrix(rotation(-math.pi / 2))],
+        (0, 0, 0)
+    )
+
+    assert orientation == pytest.approx(math.pi / 2)
+
+
+def test_origin_offset_is_rotated_with_block():
+    [(x, y, z, _)] = block_locations(
+        IDENTITY,
+        [to_block_matrix(rotation(math.pi / 2, origin=(10, 5, 0)))],
+        (1, 0, 0.5)
+    )
+
+    assert (x, y, z) == pytest.approx((10, 4, -0.5))
+
+
+def test_import_transform_is_applied_before_block_transform():
+    [(x, y, z, orientation)] = block_locations(
+        to_matrix(rotation(math.pi / 2, origin=(100, 0, 0))),
+        [to_block_matrix(rotation(0, origin=(1, 0, 0)))],
+        (0, 0, 0)
+    )
+
+    assert (x, y, z) == pytest.approx((100, 1, 0))
+    assert orientation == pytest.approx(math.pi / 2)
+
+
+def test_blocks_keep_their_order():
+    locations = block_locations(
+        IDENTITY,
+        [
+            to_block_matrix(rotation(0, origin=(i, 0, 0)))
+            for i in range(3)
+        ],
+        (0, 0, 0)
+    )
+
+    assert [x for (x, _, _, _) in locations] == pytest.approx([0, 1, 2])